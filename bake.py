@@ -0,0 +1,149 @@
+import struct
+import sys
+from array import array
+from renderer import Renderer
+from timeline import NEW_FRAME, REPEAT_FRAME
+
+# Baked animations: every frame's segment endpoints worked out ahead of time
+# (on the desktop) as whole pixels, so playback on the board is just reading
+# them (see matrix_renderer.BakedRenderer). No parsing, tweening or trig.
+#
+#   python bake.py example.anim example.bake --size 64x32
+#
+# File layout (little endian):
+#   header:  b"BAKE", version (B), segments (B), width (H), height (H),
+#            fps (f), frames (I)
+#   kinds:   one byte per frame, the timeline frame kind (NEW_FRAME,
+#            REPEAT_FRAME or TWEEN_FRAME)
+#   records: for every frame that isn't a REPEAT_FRAME, segments x
+#            [x0, y0, x1, y1] as int16, in Body.segments order
+#
+# Coordinates are truncated the same way MatrixScene does it and clamped to
+# the int16 range.
+
+MAGIC = b"BAKE"
+VERSION = 1
+HEADER = "<4sBBHHfI"
+
+_INT16_MIN = -32768
+_INT16_MAX = 32767
+
+
+def _clamp(value: float) -> int:
+    value = int(value)
+    if value < _INT16_MIN:
+        return _INT16_MIN
+    if value > _INT16_MAX:
+        return _INT16_MAX
+    return value
+
+
+class Baker(Renderer):
+    """Plays a script and writes each frame's endpoints to outfile"""
+
+    def __init__(self, infile, body, body_params, outfile):
+        super().__init__(infile, body, body_params)
+        self.outfile = outfile
+        self.kinds = bytearray()
+        self.records = array("h")
+        self.kind = NEW_FRAME
+
+    def frames(self, start: int = 0, stop: int = None):
+        for kind in super().frames(start, stop):
+            self.kind = kind
+            yield kind
+
+    def render_frame(self):
+        self.body.update_params(self.body_params)
+        self.kinds.append(self.kind)
+        records = self.records
+        for segment in self.body.segments:
+            records.append(_clamp(segment.start.x))
+            records.append(_clamp(segment.start.y))
+            records.append(_clamp(segment.end.x))
+            records.append(_clamp(segment.end.y))
+
+    def render_last_frame(self):
+        self.kinds.append(REPEAT_FRAME)
+
+    def finish(self):
+        if sys.byteorder != "little":
+            self.records.byteswap()
+        self.outfile.write(
+            struct.pack(
+                HEADER,
+                MAGIC,
+                VERSION,
+                len(self.body.segments),
+                self.body.width,
+                self.body.height,
+                self.config.get("fps", 10),
+                len(self.kinds),
+            )
+        )
+        self.outfile.write(self.kinds)
+        self.outfile.write(self.records)
+
+
+class BakedAnimation:
+    """Reads a baked file frame by frame from an open (binary) file, into one
+    reused array, so memory use doesn't grow with the length of the
+    animation."""
+
+    def __init__(self, infile):
+        self.infile = infile
+        header = infile.read(struct.calcsize(HEADER))
+        (
+            magic,
+            version,
+            self.segment_count,
+            self.width,
+            self.height,
+            self.fps,
+            self.frame_count,
+        ) = struct.unpack(HEADER, header)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("Not a baked animation (or wrong version)")
+        self.kinds = infile.read(self.frame_count)
+        self.records_start = len(header) + self.frame_count
+        # x0, y0, x1, y1 for each segment of the current record
+        self.endpoints = array("h", [0] * (self.segment_count * 4))
+        self.record_size = len(self.endpoints) * 2
+
+    def read(self, record: int) -> array:
+        """Loads record (counting only non-repeat frames) into endpoints"""
+        self.infile.seek(self.records_start + record * self.record_size)
+        self.infile.readinto(self.endpoints)
+        if sys.byteorder != "little":
+            self.endpoints.byteswap()
+        return self.endpoints
+
+
+def bake(script, body, outfile, body_params=None) -> int:
+    """Bakes script (a Timeline or lines) for body into outfile, returns the
+    number of frames"""
+    from stickman import BodyParams
+
+    if body_params is None:
+        body_params = BodyParams()
+    return Baker(script, body, body_params, outfile).render()
+
+
+if __name__ == "__main__":
+    import argparse
+    from stickman import Body
+    import timeline
+
+    parser = argparse.ArgumentParser(description="Bake a .anim script for playback")
+    parser.add_argument("infile", help=".anim script")
+    parser.add_argument("outfile", nargs="?", help="default: the script name + .bake")
+    parser.add_argument(
+        "--size", default="64x32", help="display WIDTHxHEIGHT (default: 64x32)"
+    )
+    args = parser.parse_args()
+
+    width, height = (int(value) for value in args.size.split("x"))
+    outfilename = args.outfile or args.infile.rsplit(".", 1)[0] + ".bake"
+    with open(outfilename, "wb") as outfile:
+        frames = bake(timeline.load(args.infile), Body(width, height), outfile)
+    print(f"Baked {frames} frames ({width}x{height}) to {outfilename}")
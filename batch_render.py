@@ -0,0 +1,214 @@
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from stickman import Body, BodyParams
+from stickman_pil import FrameCache
+from gif_writer import StreamingGifWriter
+from render_animation import PILRenderer
+import timeline
+
+# Renders many .anim scripts to GIFs in one go:
+#
+#   python batch_render.py library/ more/walk.anim --output gifs/ --workers 8
+#
+# Directories are searched for *.anim files, and each GIF keeps the script's
+# path relative to the directory it was found in (library/walk/fast.anim ->
+# gifs/walk/fast.gif), so scripts with the same name don't collide. Every worker process imports
+# Pillow and the rest once and keeps one FrameCache for all the scripts it
+# renders, so poses shared between scripts (the standing pose, common holds)
+# are only drawn once per worker. Scripts whose GIF is newer than the script
+# are skipped unless --force is given.
+
+# Per worker process, set up by init_worker
+_frame_cache: FrameCache = None
+
+
+def init_worker(cache_bytes: int):
+    global _frame_cache
+    _frame_cache = FrameCache(cache_bytes)
+
+
+def find_scripts(paths: [str]) -> [(str, str)]:
+    """The .anim files named in paths, with directories searched recursively,
+    as (path, name) pairs: name is the path relative to the directory searched
+    (just the file name for a script named directly)"""
+    scripts = []
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, subdirectories, filenames in os.walk(path):
+                subdirectories.sort()
+                for filename in sorted(filenames):
+                    if filename.endswith(".anim"):
+                        script = os.path.join(directory, filename)
+                        scripts.append((script, os.path.relpath(script, path)))
+        else:
+            scripts.append((path, os.path.basename(path)))
+    return scripts
+
+
+def output_name(name: str, output_dir: str) -> str:
+    """The GIF for a script called name (as given by find_scripts)"""
+    return os.path.join(output_dir, os.path.splitext(name)[0] + ".gif")
+
+
+def is_up_to_date(script: str, output: str) -> bool:
+    try:
+        return os.path.getmtime(output) >= os.path.getmtime(script)
+    except OSError:
+        return False
+
+
+def render_file(script: str, output: str, width: int, height: int) -> int:
+    """Renders one script to a GIF (streamed, so only the frame being encoded
+    is held in memory). Returns the number of frames."""
+    if _frame_cache is None:
+        init_worker(64 * 1024 * 1024)
+    animation = timeline.load(script)
+    body = Body(width, height)
+    # Written under a temporary name so an interrupted run never leaves a
+    # truncated GIF that looks up to date
+    partial = output + ".part"
+    try:
+        with open(partial, "wb") as outfile:
+            stream = StreamingGifWriter(outfile)
+            renderer = PILRenderer(
+                animation, body, BodyParams(), _frame_cache, stream=stream
+            )
+            frames = renderer.render()
+            stream.close()
+    except BaseException:
+        os.remove(partial)
+        raise
+    os.replace(partial, output)
+    return frames
+
+
+def render_batch(
+    scripts: [(str, str)],
+    output_dir: str,
+    width: int = 500,
+    height: int = 500,
+    workers: int = 1,
+    force: bool = False,
+    cache_bytes: int = 64 * 1024 * 1024,
+) -> dict:
+    """Renders scripts ((path, name) pairs from find_scripts) into output_dir
+    and returns a summary"""
+    started = time.perf_counter()
+    jobs = []
+    skipped = 0
+    failed = []
+    # Output file -> the script rendering to it
+    outputs = {}
+    for script, name in scripts:
+        output = output_name(name, output_dir)
+        if output in outputs:
+            # Two workers writing the same file would race on its .part file
+            failed.append(script)
+            print(
+                f"{script}: same output {output} as {outputs[output]}",
+                file=sys.stderr,
+            )
+            continue
+        outputs[output] = script
+        if not force and is_up_to_date(script, output):
+            skipped += 1
+        else:
+            os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+            jobs.append((script, output))
+
+    rendered = 0
+    frames = 0
+
+    def finished(script: str, result):
+        nonlocal rendered, frames
+        if isinstance(result, Exception):
+            failed.append(script)
+            print(f"{script}: {result}", file=sys.stderr)
+        else:
+            rendered += 1
+            frames += result
+
+    if workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(
+            workers, initializer=init_worker, initargs=(cache_bytes,)
+        ) as pool:
+            futures = {
+                pool.submit(render_file, script, output, width, height): script
+                for script, output in jobs
+            }
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                except Exception as error:
+                    result = error
+                finished(futures[future], result)
+    else:
+        init_worker(cache_bytes)
+        for script, output in jobs:
+            try:
+                result = render_file(script, output, width, height)
+            except Exception as error:
+                result = error
+            finished(script, result)
+
+    elapsed = time.perf_counter() - started
+    return {
+        "scripts": len(scripts),
+        "rendered": rendered,
+        "skipped": skipped,
+        "failed": failed,
+        "frames": frames,
+        "seconds": elapsed,
+        "fps": frames / elapsed if elapsed > 0 else 0.0,
+        "scripts_per_second": rendered / elapsed if elapsed > 0 else 0.0,
+    }
+
+
+def print_summary(summary: dict):
+    print(
+        f"Rendered {summary['rendered']} of {summary['scripts']} scripts"
+        f" ({summary['skipped']} up to date, {len(summary['failed'])} failed)"
+    )
+    print(
+        f"{summary['frames']} frames in {summary['seconds']:.2f}s:"
+        f" {summary['fps']:.0f} frames/s, {summary['scripts_per_second']:.1f} scripts/s"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render many .anim scripts to GIFs")
+    parser.add_argument("inputs", nargs="+", help=".anim scripts or directories")
+    parser.add_argument("--output", "-o", default=".", help="directory for the GIFs")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="worker processes (default: one per CPU)",
+    )
+    parser.add_argument("--size", type=int, default=500, help="canvas width/height")
+    parser.add_argument(
+        "--force", action="store_true", help="render even if the GIF is up to date"
+    )
+    parser.add_argument(
+        "--cache-mb",
+        type=int,
+        default=64,
+        help="frame cache size per worker in MiB (default: 64)",
+    )
+    args = parser.parse_args()
+
+    summary = render_batch(
+        find_scripts(args.inputs),
+        args.output,
+        args.size,
+        args.size,
+        args.workers,
+        args.force,
+        args.cache_mb * 1024 * 1024,
+    )
+    print_summary(summary)
+    if summary["failed"]:
+        sys.exit(1)
@@ -0,0 +1,363 @@
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from stickman import (
+    Body,
+    BodyParams,
+    FixedPointBody,
+    PARAM_FIELDS,
+    max_endpoint_error,
+)
+from tweener import produce_tweens, iter_tweens
+from renderer import Renderer
+
+# Benchmarks for the hot path: kinematics, tweening, drawing, script playback and
+# GIF encoding, each timed on its own over a synthetic animation.
+#
+#   python benchmark.py --keyframes 200 --tween 10 --output run.json
+#   python benchmark.py --compare run.json      # run again and show the change
+#
+# Every benchmark is run three times: once plain for timing, once under
+# tracemalloc and once while sampling the process's resident memory.
+#
+#   heap_peak_bytes   peak of the Python heap (tracemalloc). Pillow's image
+#                     buffers aren't allocated on it, so this misses them.
+#   blocks            Python heap blocks allocated by the run and still held
+#                     at its end (from a tracemalloc snapshot)
+#   rss_peak_bytes    how far resident memory rose above where it started,
+#                     which does include Pillow's buffers (sampled from
+#                     /proc/self/statm, or the process's peak RSS elsewhere,
+#                     which only shows runs that raise it)
+
+
+def generate_script(
+    keyframes: int = 100,
+    tween: int = 10,
+    fields_per_keyframe: int = 2,
+    holds: int = 0,
+    seed: int = 0,
+) -> list[str]:
+    """Makes a random .anim script. tween is the ">N" count before each
+    keyframe (0 for none); holds adds a "*N" repeat after each keyframe."""
+    generator = random.Random(seed)
+    lines = ["*1"]
+    for keyframe in range(keyframes):
+        if tween > 0:
+            lines.append(f">{tween}")
+        fields = generator.sample(PARAM_FIELDS, fields_per_keyframe)
+        lines.append(
+            ",".join(f"{field}={generator.uniform(-180, 180):.1f}" for field in fields)
+        )
+        if holds > 0:
+            lines.append(f"*{holds}")
+    return lines
+
+
+class NullRenderer(Renderer):
+    """Plays a script doing only the kinematics for each frame"""
+
+    def render_frame(self):
+        self.body.update_params(self.body_params)
+
+    def render_last_frame(self):
+        pass
+
+
+def collect_poses(script: list[str]) -> list[BodyParams]:
+    poses = []
+
+    class PoseRecorder(Renderer):
+        def render_frame(self):
+            poses.append(BodyParams())
+            poses[-1].copy_from(self.body_params)
+
+        def render_last_frame(self):
+            poses.append(poses[-1])
+
+    PoseRecorder(script, Body(500, 500), BodyParams()).render()
+    return poses
+
+
+def _rss_bytes() -> int:
+    """Current resident memory, None without /proc (e.g. macOS)"""
+    try:
+        with open("/proc/self/statm") as infile:
+            return int(infile.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+def _max_rss_bytes() -> int:
+    import resource
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _release_free_memory():
+    # glibc keeps freed memory (e.g. an earlier run's images) resident and
+    # hands it out again, which would hide this run's growth
+    try:
+        import ctypes
+
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (ImportError, OSError, AttributeError):
+        pass
+
+
+def rss_growth(run) -> int:
+    """How far resident memory rises above its starting point during run()"""
+    _release_free_memory()
+    baseline = _rss_bytes()
+    if baseline is None:
+        before = _max_rss_bytes()
+        run()
+        return _max_rss_bytes() - before
+
+    peak = baseline
+    done = threading.Event()
+
+    def sample():
+        nonlocal peak
+        while not done.wait(0.0005):
+            peak = max(peak, _rss_bytes())
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    try:
+        run()
+    finally:
+        done.set()
+        sampler.join()
+    return max(peak, _rss_bytes()) - baseline
+
+
+def measure(run, frames: int, setup=None) -> dict:
+    """Times run() (which handles frames frames) and then runs it again for
+    memory (see the top of the file). setup() is called, untimed, before each
+    run, e.g. to drop what the previous run kept."""
+    if setup is not None:
+        setup()
+    gc.collect()
+    started = time.perf_counter()
+    run()
+    elapsed = time.perf_counter() - started
+
+    if setup is not None:
+        setup()
+    gc.collect()
+    tracemalloc.start()
+    run()
+    heap_peak = tracemalloc.get_traced_memory()[1]
+    snapshot = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    blocks = sum(stat.count for stat in snapshot.statistics("filename"))
+
+    if setup is not None:
+        setup()
+    gc.collect()
+    rss_peak = rss_growth(run)
+
+    return {
+        "frames": frames,
+        "seconds": elapsed,
+        "fps": frames / elapsed if elapsed > 0 else None,
+        "heap_peak_bytes": heap_peak,
+        "blocks": blocks,
+        "rss_peak_bytes": rss_peak,
+    }
+
+
+def run_benchmarks(script: list[str], width: int, height: int, tween: int) -> dict:
+    poses = collect_poses(script)
+    frames = len(poses)
+    body = Body(width, height)
+    results = {}
+
+    def kinematics():
+        for pose in poses:
+            body.update_params(pose)
+
+    results["update_params"] = measure(kinematics, frames)
+
+    fixed_body = FixedPointBody(width, height)
+
+    def fixed_point_kinematics():
+        for pose in poses:
+            fixed_body.update_params(pose)
+
+    results["fixed_point_update_params"] = measure(fixed_point_kinematics, frames)
+    results["fixed_point_update_params"]["max_error_pixels"] = max_endpoint_error(
+        fixed_body, Body(width, height), poses
+    )
+
+    keyframes = poses[:: max(tween, 1)]
+    tween_steps = max(tween, 2)
+    tween_frames = (len(keyframes) - 1) * tween_steps
+
+    def tweening():
+        for start, end in zip(keyframes, keyframes[1:]):
+            produce_tweens(start, end, tween_steps)
+
+    results["produce_tweens"] = measure(tweening, tween_frames)
+
+    def streaming_tweening():
+        buffer = BodyParams()
+        for start, end in zip(keyframes, keyframes[1:]):
+            for pose in iter_tweens(start, end, tween_steps, buffer):
+                pass
+
+    results["iter_tweens"] = measure(streaming_tweening, tween_frames)
+
+    def playback():
+        NullRenderer(script, Body(width, height), BodyParams()).render()
+
+    results["render"] = measure(playback, frames)
+
+    try:
+        from stickman_pil import make_pil_frame, BodyPalette
+        from render_animation import PILRenderer
+    except ImportError:
+        print("Pillow not installed, skipping drawing and encoding", file=sys.stderr)
+    else:
+        images = []
+
+        def drawing():
+            for pose in poses:
+                images.append(make_pil_frame(body, pose))
+
+        results["make_pil_frame"] = measure(drawing, frames, images.clear)
+
+        renderer = PILRenderer([], body, BodyParams())
+        renderer.results = images
+
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "benchmark.gif")
+            results["write_animated_gif"] = measure(
+                lambda: renderer.write_animated_gif(filename), frames
+            )
+
+            # Same again with frames drawn straight into a fixed palette
+            palette = BodyPalette(body)
+            palette_images = []
+
+            def palette_drawing():
+                for pose in poses:
+                    palette_images.append(make_pil_frame(body, pose, palette=palette))
+
+            results["make_pil_frame_palette"] = measure(
+                palette_drawing, frames, palette_images.clear
+            )
+            renderer.results = palette_images
+            results["write_animated_gif_palette"] = measure(
+                lambda: renderer.write_animated_gif(filename), frames
+            )
+
+    try:
+        from stickman_np import params_to_array, solve_poses
+    except ImportError:
+        print("NumPy not installed, skipping batch kinematics", file=sys.stderr)
+    else:
+        from stickman import SEGMENT_NAMES
+        from stickman_np import END
+        from stickman_ik import solve_ik
+
+        angles = params_to_array(poses)
+        results["solve_poses"] = measure(lambda: solve_poses(body, angles), frames)
+
+        # Put the left hand where each pose has it, starting from the default
+        hands = solve_poses(body, angles)[:, SEGMENT_NAMES.index("left_hand"), END]
+        start = params_to_array([BodyParams()])
+        results["solve_ik"] = measure(
+            lambda: solve_ik(body, start, "left_hand", hands), frames
+        )
+
+    return results
+
+
+def print_results(results: dict, previous: dict = None):
+    print(
+        f"{'benchmark':<26} {'fps':>12} {'heap KiB':>10} {'RSS KiB':>10}"
+        f" {'blocks':>8}  change"
+    )
+    for name, result in results.items():
+        change = ""
+        if previous and name in previous and previous[name]["fps"] and result["fps"]:
+            change = f"{result['fps'] / previous[name]['fps']:.2f}x"
+        print(
+            f"{name:<26} {result['fps'] or 0:>12.0f}"
+            f" {result['heap_peak_bytes'] / 1024:>10.0f}"
+            f" {result['rss_peak_bytes'] / 1024:>10.0f}"
+            f" {result['blocks']:>8}  {change}"
+        )
+
+
+# Options that change what is measured (so runs are only comparable if they
+# match)
+SETTINGS = ("keyframes", "tween", "fields", "holds", "size", "seed")
+
+
+def settings_differences(settings: dict, previous: dict) -> list[str]:
+    return [
+        f"{name} {previous.get(name)} -> {settings.get(name)}"
+        for name in SETTINGS
+        if settings.get(name) != previous.get(name)
+    ]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the animation pipeline")
+    parser.add_argument("--keyframes", type=int, default=100)
+    parser.add_argument("--tween", type=int, default=10, help="frames per tween")
+    parser.add_argument("--fields", type=int, default=2, help="fields per keyframe")
+    parser.add_argument("--holds", type=int, default=0, help="repeats per keyframe")
+    parser.add_argument("--size", type=int, default=500, help="canvas width/height")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write results to this JSON file")
+    parser.add_argument("--compare", help="JSON file from an earlier run")
+    args = parser.parse_args()
+
+    script = generate_script(
+        args.keyframes, args.tween, args.fields, args.holds, args.seed
+    )
+    results = run_benchmarks(script, args.size, args.size, args.tween)
+
+    previous = None
+    if args.compare:
+        with open(args.compare) as infile:
+            previous_run = json.load(infile)
+        previous = previous_run["results"]
+        differences = settings_differences(
+            vars(args), previous_run.get("settings", {})
+        )
+        if differences:
+            print(
+                f"Warning: {args.compare} was run with different settings"
+                f" ({', '.join(differences)}), changes aren't comparable",
+                file=sys.stderr,
+            )
+    print_results(results, previous)
+
+    if args.output:
+        with open(args.output, "w") as outfile:
+            json.dump(
+                {
+                    "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "settings": vars(args),
+                    "results": results,
+                },
+                outfile,
+                indent=2,
+            )
@@ -1,8 +1,11 @@
-import sys
-import time
-from stickman import Body, BodyParams
-from renderer import Renderer
-
+from stickman import FixedPointBody, BodyParams
+from matrix_renderer import MatrixRenderer, MatrixScene, BakedRenderer, StreamPlayer
+from bake import BakedAnimation
+from pose_stream import PoseStreamReceiver
+from profiler import Profiler
+import timeline
+
+import asyncio
 import board
 import displayio
 import framebufferio
@@ -25,65 +28,55 @@ matrix = rgbmatrix.RGBMatrix(
 )
 display = framebufferio.FramebufferDisplay(matrix, auto_refresh=False)
 
-splash = displayio.Group()
-display.root_group = splash
-
-FPS = 10
-FRAME_TIME = 1 / FPS
-
-
-class MatrixRenderer(Renderer):
-    def __init__(
-        self, infile, body: Body, body_params: BodyParams, display: displayio.Display
-    ):
-        super().__init__(infile, body, body_params)
-        self.render_started = None
-        self.display = display
-
-    def render_frame(self):
-        self.render_started = time.monotonic()
-        #print(f"Rendering frame at {self.render_started}")
-        new_group = displayio.Group(scale=1)
-        self.body.update_params(self.body_params)
-        segments = self.body.get_segments()
-        display.auto_refresh = False
-
-        for segment in segments:
-            new_line = line.Line(
-                    x0=int(segment.start.x),
-                    y0=int(segment.start.y),
-                    x1=int(segment.end.x),
-                    y1=int(segment.end.y),
-                    color=0xFFFFFF,
-                )
-            new_group.append(
-                new_line
-            )
-        display.root_group = new_group
-        display.refresh(minimum_frames_per_second=0)
-
-    def render_last_frame(self):
-        self.render_started = time.monotonic()
-        #print(f"Re-rendering frame at {self.render_started}")
-        # do nothing here
-
-    def wait_for_frame(self):
-        # Probably we should be doing a callback rather than a sleep?
-        if self.render_started is None:
-            return
-        deadline = self.render_started + FRAME_TIME
-        wait_time = deadline - time.monotonic()
-        if wait_time > 0:
-            #print(f"Waiting {wait_time} seconds")
-            time.sleep(wait_time)
-
-
-
-body = Body(64, 32)
+# Print per-phase timings and missed frame deadlines after every loop
+PROFILE = False
+
+# Draw whatever a host streams over USB instead of playing an animation
+# (python pose_stream.py example.anim --device /dev/ttyACM1 on the host). Needs
+# usb_cdc.enable(data=True) in boot.py.
+STREAM = False
+
+# Line shapes are created once and only replaced when a segment moves
+scene = MatrixScene(displayio.Group(), line.Line)
+
+# Sine table + integer kinematics: plenty accurate for a 64x32 display (within a
+# pixel of the float path) and much cheaper than math.sin/cos on the board
+body = FixedPointBody(64, 32)
 body_params = BodyParams()
 
-while True:
-    infile = open("example.anim")
-    renderer = MatrixRenderer(infile, body, body_params, display)
-    number_frames = renderer.render()
-    print(f"Completed rendering with {number_frames} frames")
+# Compiled once (and cached as example.animc when the drive is writable), then
+# replayed without re-parsing on every loop
+animation = timeline.load("example.anim")
+
+# If example.bake is on the drive (python bake.py example.anim on the desktop),
+# play that instead: the endpoints are read straight from the file
+try:
+    baked = BakedAnimation(open("example.bake", "rb"))
+except OSError:
+    baked = None
+
+
+async def stream():
+    import usb_cdc
+
+    player = StreamPlayer(PoseStreamReceiver(usb_cdc.data), display, scene, body)
+    while True:
+        player.poll()
+        await asyncio.sleep(0)
+
+
+async def main():
+    # play() keeps frames on their deadlines (dropping in-between tween frames
+    # if the board falls behind) and leaves room for other tasks, e.g. buttons
+    while True:
+        if baked is not None:
+            renderer = BakedRenderer(baked, display, scene)
+        else:
+            renderer = MatrixRenderer(animation, body, body_params, display, scene)
+        if PROFILE:
+            renderer.profiler = Profiler()
+        shown, skipped = await renderer.play(renderer.frame_time)
+        print(f"Completed rendering with {shown} frames ({skipped} skipped)")
+
+
+asyncio.run(stream() if STREAM else main())
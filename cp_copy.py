@@ -1,7 +1,6 @@
 def deepcopy(inobj):
     outobj = inobj.__class__() # assume default empty constructor OK
-    for field_name in inobj.__dict__:
+    # Slotted classes (like BodyParams) have no __dict__
+    for field_name in getattr(inobj, "__slots__", None) or inobj.__dict__:
         setattr(outobj, field_name, getattr(inobj, field_name))
     return outobj
-
-        
@@ -0,0 +1,109 @@
+import numpy as np
+from stickman import Body, BodyParams
+from stickman_np import Framebuffer, params_to_array, solve_poses
+
+# Scenes with many stick figures on one canvas. All the figures' poses are
+# solved in one solve_poses batch and drawn in a single Framebuffer pass,
+# instead of looping over Body.update_params and ImageDraw per figure.
+
+
+class Figure:
+    """One member of a Crowd: its pose, where it stands and how far back it is.
+    (x, y) is where the figure's Body.center ends up on the canvas; z_order
+    works like Segment.z_order (0 is in front and full brightness)."""
+
+    def __init__(
+        self,
+        body_params: BodyParams = None,
+        x: float = 0.0,
+        y: float = 0.0,
+        scale: float = 1.0,
+        z_order: float = 0.0,
+    ):
+        self.body_params = body_params if body_params is not None else BodyParams()
+        self.x = x
+        self.y = y
+        self.scale = scale
+        self.z_order = z_order
+
+
+class Crowd:
+    def __init__(self, width: int, height: int, overall_scale_factor: float = 3.0):
+        self.width = width
+        self.height = height
+        # Reference figure all the others are solved with, then moved and scaled
+        self.body = Body(width, height, overall_scale_factor)
+        self.figures: list[Figure] = []
+
+    def add(self, body_params: BodyParams = None, **placement) -> Figure:
+        figure = Figure(body_params, **placement)
+        self.figures.append(figure)
+        return figure
+
+    def solve(self) -> np.ndarray:
+        """Segment endpoints for every figure, F x 19 x 2 x 2 in canvas
+        coordinates (same layout as solve_poses, one row per figure)"""
+        figures = self.figures
+        endpoints = solve_poses(
+            self.body, params_to_array([figure.body_params for figure in figures])
+        )
+        scale = np.array([figure.scale for figure in figures])
+        position = np.array([(figure.x, figure.y) for figure in figures])
+        endpoints -= self.body.center
+        endpoints *= scale[:, np.newaxis, np.newaxis, np.newaxis]
+        endpoints += position[:, np.newaxis, np.newaxis, :]
+        return endpoints
+
+    def draw(
+        self,
+        framebuffer: Framebuffer,
+        color=255,
+        thickness: int = 1,
+        antialias: bool = False,
+    ):
+        """Draws every figure into frame 0 of framebuffer, back to front"""
+        if not self.figures:
+            framebuffer.pixels[0] = 0
+            return
+        endpoints = self.solve()
+        z_order = np.array([figure.z_order for figure in self.figures])
+        back_to_front = np.argsort(-z_order, kind="stable")
+        segments_per_figure = endpoints.shape[1]
+
+        # Like scale_color in stickman_pil: figures further back are dimmer
+        colors = np.broadcast_to(
+            np.asarray(color, dtype=float), (framebuffer.channels,)
+        ) * (1 - z_order[back_to_front])[:, np.newaxis]
+        framebuffer.draw(
+            endpoints[back_to_front].reshape(1, -1, 2, 2),
+            np.repeat(colors, segments_per_figure, axis=0),
+            thickness,
+            antialias,
+        )
+
+
+if __name__ == "__main__":
+    import random
+    import sys
+    import time
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    crowd = Crowd(1000, 600)
+    for index in range(count):
+        pose = BodyParams()
+        pose.neck_left_collar_bone = random.uniform(45, 135)
+        pose.neck_right_collar_bone = random.uniform(-135, -45)
+        pose.left_hip_left_thigh = random.uniform(40, 90)
+        crowd.add(
+            pose,
+            x=random.uniform(0, 1000),
+            y=random.uniform(100, 500),
+            scale=random.uniform(0.2, 0.5),
+            z_order=random.uniform(0, 0.8),
+        )
+
+    framebuffer = Framebuffer(1000, 600)
+    started = time.monotonic()
+    crowd.draw(framebuffer)
+    print(f"{count} figures in {time.monotonic() - started:.3f}s")
+    framebuffer.to_image().save("crowd.png")
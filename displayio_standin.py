@@ -0,0 +1,83 @@
+# Minimal desktop stand-ins for the displayio pieces MatrixRenderer uses, so the
+# LED matrix path can be run and benchmarked without hardware. They only keep
+# track of what would have been drawn.
+
+
+class Line:
+    """Stands in for adafruit_display_shapes.line.Line"""
+
+    created = 0
+
+    def __init__(self, x0: int, y0: int, x1: int, y1: int, color: int):
+        Line.created += 1
+        self.x0 = x0
+        self.y0 = y0
+        self.x1 = x1
+        self.y1 = y1
+        self.color = color
+
+    def area(self) -> (int, int, int, int):
+        return (
+            min(self.x0, self.x1),
+            min(self.y0, self.y1),
+            max(self.x0, self.x1),
+            max(self.y0, self.y1),
+        )
+
+
+class Group:
+    """Stands in for displayio.Group. Remembers the area touched by changes
+    since the display last refreshed."""
+
+    def __init__(self, scale: int = 1):
+        self.scale = scale
+        self.items = []
+        self.dirty = None
+
+    def _touch(self, item):
+        area = item.area()
+        if self.dirty is None:
+            self.dirty = area
+        else:
+            self.dirty = (
+                min(self.dirty[0], area[0]),
+                min(self.dirty[1], area[1]),
+                max(self.dirty[2], area[2]),
+                max(self.dirty[3], area[3]),
+            )
+
+    def append(self, item):
+        self.items.append(item)
+        self._touch(item)
+
+    def __setitem__(self, index: int, item):
+        self._touch(self.items[index])
+        self.items[index] = item
+        self._touch(item)
+
+    def __getitem__(self, index: int):
+        return self.items[index]
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+
+class Display:
+    """Stands in for framebufferio.FramebufferDisplay with auto_refresh off"""
+
+    def __init__(self, width: int, height: int):
+        self.width = width
+        self.height = height
+        self.root_group = None
+        self.auto_refresh = True
+        self.refresh_count = 0
+        self.refreshed_pixels = 0
+
+    def refresh(self, minimum_frames_per_second: int = 0) -> bool:
+        self.refresh_count += 1
+        group = self.root_group
+        if group is not None and group.dirty is not None:
+            x0, y0, x1, y1 = group.dirty
+            self.refreshed_pixels += (x1 - x0 + 1) * (y1 - y0 + 1)
+            group.dirty = None
+        return True
@@ -0,0 +1,147 @@
+from renderer import Renderer
+
+# Renders one script to several outputs at once, e.g. the 64x32 matrix
+# preview and the 500x500 GIF:
+#
+#   python fanout.py example.anim 500x500:animation.gif 64x32:matrix.gif
+#
+# The script is parsed and tweened once. Every frame's pose (just angles, so
+# the same at any resolution) is then handed to each target renderer, which
+# solves it for its own Body (size and scale) and draws/encodes it its own way.
+#
+# Kinematics stay per target: the spine is rounded to whole pixels at each
+# resolution and a target may use FixedPointBody, so endpoints can't simply be
+# scaled from one shared solution. Body.update_params is incremental though,
+# so that part is small next to drawing and encoding.
+
+
+class FanOutRenderer(Renderer):
+    """Plays a script once and renders each frame with every target (any
+    Renderer, constructed with its own Body)"""
+
+    def __init__(self, infile, body_params, targets: list[Renderer] = None):
+        super().__init__(infile, None, body_params)
+        self.targets: list[Renderer] = []
+        # Overall scale factor each target is pinned to, None to follow the
+        # script's "scale" option
+        self.scales: list[float] = []
+        for target in targets or []:
+            self.add(target)
+
+    def add(self, target: Renderer, scale: float = None) -> Renderer:
+        """Adds a target. With a scale, the target's body keeps that overall
+        scale factor whatever the script sets."""
+        if scale is not None:
+            target.body.set_scale_factor(scale)
+        self.targets.append(target)
+        self.scales.append(scale)
+        return target
+
+    def update_options(self, options):
+        for name, value in options:
+            self.config[name] = value
+        for target, scale in zip(self.targets, self.scales):
+            if scale is None:
+                target.update_options(options)
+            else:
+                target.update_options(
+                    [(name, value) for name, value in options if name != "scale"]
+                )
+
+    def render_frame(self):
+        for target in self.targets:
+            target.body_params = self.body_params
+            target.render_frame()
+
+    def render_last_frame(self):
+        for target in self.targets:
+            target.render_last_frame()
+
+    def prepare_frame(self):
+        for target in self.targets:
+            target.body_params = self.body_params
+            target.prepare_frame()
+
+    def prepare_repeat(self):
+        for target in self.targets:
+            target.prepare_repeat()
+
+    def present_frame(self):
+        for target in self.targets:
+            target.present_frame()
+
+    def finish(self):
+        for target in self.targets:
+            target.finish()
+
+    def frames(self, start: int = 0, stop: int = None):
+        # Targets record their phases in the same profile
+        for target in self.targets:
+            target.profiler = self.profiler
+        return super().frames(start, stop)
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+    from stickman import Body, BodyParams
+    from stickman_pil import FrameCache, BodyPalette
+    from gif_writer import StreamingGifWriter
+    from raw_writer import RawFrameWriter
+    from render_animation import PILRenderer
+    import timeline
+
+    parser = argparse.ArgumentParser(
+        description="Render a .anim script to several sizes/outputs in one pass"
+    )
+    parser.add_argument("infile", help=".anim script")
+    parser.add_argument(
+        "targets",
+        nargs="+",
+        metavar="WIDTHxHEIGHT[@SCALE]:OUTFILE",
+        help="an output: .gif files are streamed GIFs, anything else raw RGB",
+    )
+    parser.add_argument(
+        "--palette",
+        action="store_true",
+        help="draw GIF targets as palette frames (no quantizing)",
+    )
+    args = parser.parse_args()
+
+    frame_cache = FrameCache()
+    fanout = FanOutRenderer(timeline.load(args.infile), BodyParams())
+    outfiles = []
+    streams = []
+    for spec in args.targets:
+        size, _, outfilename = spec.partition(":")
+        size, _, scale = size.partition("@")
+        width, height = (int(value) for value in size.split("x"))
+        body = Body(width, height)
+        outfile = open(outfilename, "wb")
+        palette = None
+        if outfilename.endswith(".gif"):
+            if args.palette:
+                palette = BodyPalette(body)
+            stream = StreamingGifWriter(
+                outfile, palette=palette.image() if palette is not None else None
+            )
+        else:
+            stream = RawFrameWriter(outfile)
+        target = PILRenderer(
+            None, body, BodyParams(), frame_cache, stream=stream, palette=palette
+        )
+        fanout.add(target, float(scale) if scale else None)
+        outfiles.append(outfile)
+        streams.append((outfilename, stream))
+
+    started = time.perf_counter()
+    frames = fanout.render()
+    elapsed = time.perf_counter() - started
+    for (outfilename, stream), outfile in zip(streams, outfiles):
+        stream.close()
+        outfile.close()
+        print(f"Wrote {stream.frame_count} frames to {outfilename}")
+    print(
+        f"{frames} frames x {len(streams)} targets in {elapsed:.2f}s"
+        f" ({frames * len(streams) / elapsed:.0f} frames/s)"
+    )
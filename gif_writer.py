@@ -0,0 +1,151 @@
+import struct
+from PIL import Image, ImageChops, GifImagePlugin
+
+# Disposal method 1: leave the frame in place, so the next (partial) frame is
+# drawn on top of it
+DISPOSAL_KEEP = 1
+
+
+class StreamingGifWriter:
+    """Writes an animated GIF to fp one frame at a time, instead of holding
+    every frame until the end like Image.save(save_all=True).
+
+    Only the previous frame is kept in memory. The first frame is written in
+    full; every frame after that only stores the bounding box of the pixels
+    that changed, drawn over the frame before it.
+
+    Consecutive identical frames (the same Image object, or the same pixels)
+    are written once, shown for the sum of their durations. So each frame is
+    held back until the next one differs (or close() is called).
+
+    RGB frames get their own (exact, adaptive) color table. If a palette ("P"
+    mode image) is given, it is written as the global color table and "P"
+    frames using it are written as-is, with no quantizing at all."""
+
+    def __init__(self, fp, loop: int = 0, palette: Image = None):
+        self.fp = fp
+        self.palette = palette
+        self.loop = loop
+        self.previous: Image = None
+        # Frames added, and frames actually written after coalescing
+        self.frame_count = 0
+        self.written_count = 0
+        # The frame waiting for the next one: image, total duration, and the
+        # box that changed since previous (worked out when it was compared)
+        self._pending: Image = None
+        self._pending_duration = 0.0
+        self._pending_box = None
+
+    def _write_header(self, size: (int, int)):
+        if self.palette is None:
+            # 8 bits per color, no global color table
+            header = struct.pack("<BBB", 0x70, 0, 0)
+        else:
+            palette_bytes = bytes(self.palette.getpalette()[: 256 * 3])
+            palette_bytes += bytes(256 * 3 - len(palette_bytes))
+            # global color table, 8 bits per color, 256 entries
+            header = struct.pack("<BBB", 0xF7, 0, 0) + palette_bytes
+        self.fp.write(b"GIF89a" + struct.pack("<HH", size[0], size[1]) + header)
+        if self.loop is not None:
+            self.fp.write(
+                b"!\xff\x0bNETSCAPE2.0\x03\x01" + struct.pack("<H", self.loop) + b"\0"
+            )
+
+    def encode_frame(
+        self, image: Image, previous: Image, duration: float, box=None
+    ) -> bytes:
+        """The GIF blocks for image shown for duration milliseconds, drawn over
+        previous (None for the first frame). box is the area that changed, if
+        already known."""
+        if previous is None:
+            box = (0, 0) + image.size
+        elif box is None:
+            box = changed_box(image, previous)
+        if box is None:
+            # Identical frames still need a (tiny) frame to hold the timing
+            box = (0, 0, 1, 1)
+
+        region = image if box == (0, 0) + image.size else image.crop(box)
+        local_palette = region.mode != "P" or self.palette is None
+        if region.mode != "P":
+            region = region.convert("P", palette=Image.ADAPTIVE)
+        return b"".join(
+            GifImagePlugin.getdata(
+                region,
+                offset=box[:2],
+                duration=duration,
+                disposal=DISPOSAL_KEEP,
+                include_color_table=local_palette,
+            )
+        )
+
+    def add_frame(self, image: Image, duration: float, count: int = 1):
+        """Appends a frame shown for duration milliseconds (count frames in a
+        row, already merged by the caller, if count > 1)"""
+        self.frame_count += count
+        pending = self._pending
+        if pending is not None:
+            box = None if image is pending else changed_box(image, pending)
+            if box is None:
+                self._pending_duration += duration
+                return
+            self.flush()
+            self._pending_box = box
+        self._pending = image
+        self._pending_duration = duration
+
+    def flush(self):
+        """Writes out the frame being held back"""
+        image = self._pending
+        if image is None:
+            return
+        if self.previous is None:
+            self._write_header(image.size)
+        self.fp.write(
+            self.encode_frame(
+                image, self.previous, self._pending_duration, self._pending_box
+            )
+        )
+        self.previous = image
+        self.written_count += 1
+        self._pending = None
+        self._pending_box = None
+
+    def add_encoded(self, data: bytes, count: int, written: int, last: Image):
+        """Appends frames encoded earlier with encode_frame (e.g. kept in a
+        cache): count frames, coalesced into written GIF frames, the first of
+        them drawn over the current last frame. last is the final frame of
+        them, which the next frame is drawn over."""
+        self.flush()
+        self.fp.write(data)
+        if written:
+            self.previous = last
+        self.frame_count += count
+        self.written_count += written
+
+    def close(self):
+        self.flush()
+        self.fp.write(b";")
+        self.fp.flush()
+
+
+def changed_box(image: Image, previous: Image) -> (int, int, int, int):
+    """Bounding box of the pixels that differ, None if the frames are the same"""
+    if image is previous:
+        return None
+    return ImageChops.difference(image, previous).getbbox()
+
+
+def coalesce(frames: [Image], duration: float) -> ([Image], [float]):
+    """Merges runs of identical consecutive frames (the same object, or the
+    same pixels) into one frame each, returning the frames and how long each
+    is shown for"""
+    images = []
+    durations = []
+    for image in frames:
+        if images and changed_box(image, images[-1]) is None:
+            durations[-1] += duration
+        else:
+            images.append(image)
+            durations.append(duration)
+    return images, durations
@@ -0,0 +1,280 @@
+import time
+from stickman import Body, BodyParams, PARAM_FIELDS
+from renderer import Renderer
+from timeline import NEW_FRAME, REPEAT_FRAME
+from pose_stream import KEY_ENDPOINTS, DELTA_ENDPOINTS
+
+# Hardware independent half of code.py: the display, group and line shape class
+# are passed in, so this runs on the desktop against displayio_standin too.
+
+FPS = 10
+FRAME_TIME = 1 / FPS
+
+
+class MatrixScene:
+    """Retained-mode drawing of a Body on a displayio group.
+
+    The group holds one line shape per segment, created the first time it is
+    drawn. After that, only segments whose integer endpoints changed get a new
+    shape (adafruit_display_shapes lines can't be moved in place), swapped into
+    the same slot of the group, so displayio only has to redraw those areas."""
+
+    def __init__(self, group, make_line, color: int = 0xFFFFFF):
+        self.group = group
+        self.make_line = make_line
+        self.color = color
+        # x0, y0, x1, y1 for each segment drawn so far
+        self.endpoints: list[int] = []
+
+    def update(self, segments: list, changed: list = None) -> (int, int, int, int):
+        """Brings the group in line with segments. If changed (e.g.
+        Body.changed) is given, segments it marks False are skipped without
+        looking at them. Returns the dirty area (x0, y0, x1, y1) covering every
+        line that moved, or None if nothing did."""
+        endpoints = self.endpoints
+        dirty = None
+        for index, segment in enumerate(segments):
+            offset = index * 4
+            if changed is not None and not changed[index] and offset < len(endpoints):
+                continue
+            x0 = int(segment.start.x)
+            y0 = int(segment.start.y)
+            x1 = int(segment.end.x)
+            y1 = int(segment.end.y)
+            dirty = self._move(index, x0, y0, x1, y1, dirty)
+        return dirty
+
+    def update_endpoints(self, values) -> (int, int, int, int):
+        """Like update, but from whole-pixel endpoints: x0, y0, x1, y1 for
+        each segment in turn (e.g. a baked record)"""
+        dirty = None
+        for index in range(len(values) // 4):
+            offset = index * 4
+            dirty = self._move(
+                index,
+                values[offset],
+                values[offset + 1],
+                values[offset + 2],
+                values[offset + 3],
+                dirty,
+            )
+        return dirty
+
+    def _move(self, index: int, x0: int, y0: int, x1: int, y1: int, dirty):
+        """Puts line index at x0, y0, x1, y1 unless it is there already, and
+        returns dirty grown to cover the change"""
+        endpoints = self.endpoints
+        offset = index * 4
+        if offset < len(endpoints):
+            if (
+                endpoints[offset] == x0
+                and endpoints[offset + 1] == y0
+                and endpoints[offset + 2] == x1
+                and endpoints[offset + 3] == y1
+            ):
+                return dirty
+            dirty = _extend(dirty, endpoints[offset : offset + 4])
+            self.group[index] = self.make_line(x0, y0, x1, y1, self.color)
+            endpoints[offset] = x0
+            endpoints[offset + 1] = y0
+            endpoints[offset + 2] = x1
+            endpoints[offset + 3] = y1
+        else:
+            self.group.append(self.make_line(x0, y0, x1, y1, self.color))
+            endpoints.extend((x0, y0, x1, y1))
+        return _extend(dirty, (x0, y0, x1, y1))
+
+
+def _extend(area, line) -> (int, int, int, int):
+    """Grows area (or None) to cover both ends of line (x0, y0, x1, y1)"""
+    left = min(line[0], line[2])
+    top = min(line[1], line[3])
+    right = max(line[0], line[2])
+    bottom = max(line[1], line[3])
+    if area is None:
+        return (left, top, right, bottom)
+    return (
+        min(area[0], left),
+        min(area[1], top),
+        max(area[2], right),
+        max(area[3], bottom),
+    )
+
+
+class MatrixRenderer(Renderer):
+    def __init__(
+        self, infile, body: Body, body_params: BodyParams, display, scene: MatrixScene
+    ):
+        super().__init__(infile, body, body_params)
+        self.render_started = None
+        self.display = display
+        self.scene = scene
+        self.frame_time = FRAME_TIME
+        # Area changed by the last prepare_frame, still to be refreshed
+        self.dirty = None
+        self.display.auto_refresh = False
+        self.display.root_group = scene.group
+
+    def render_frame(self):
+        self.render_started = time.monotonic()
+        #print(f"Rendering frame at {self.render_started}")
+        self.prepare_frame()
+        self.present_frame()
+
+    def prepare_frame(self):
+        self.begin_phase("kinematics")
+        self.body.update_params(self.body_params)
+        self.end_phase("kinematics")
+        self.begin_phase("draw")
+        # Body.changed lines up with Body.segments (not the z-sorted list);
+        # every segment is the same color so the order doesn't matter here
+        self.dirty = self.scene.update(self.body.segments, self.body.changed)
+        self.end_phase("draw")
+
+    def present_frame(self):
+        # auto_refresh is off, so nothing shows until this refresh
+        if self.dirty is not None:
+            self.begin_phase("refresh")
+            self.display.refresh(minimum_frames_per_second=0)
+            self.end_phase("refresh")
+            self.dirty = None
+
+    def render_last_frame(self):
+        self.render_started = time.monotonic()
+        #print(f"Re-rendering frame at {self.render_started}")
+        # do nothing here
+
+    def wait_for_frame(self):
+        # Probably we should be doing a callback rather than a sleep?
+        if self.render_started is None:
+            return
+        deadline = self.render_started + self.frame_time
+        wait_time = deadline - time.monotonic()
+        if wait_time > 0:
+            #print(f"Waiting {wait_time} seconds")
+            time.sleep(wait_time)
+        elif self.profiler is not None and self.frame_time > 0:
+            self.profiler.missed_deadline(-wait_time)
+
+
+class BakedRenderer(MatrixRenderer):
+    """Plays a bake.BakedAnimation: each frame's endpoints are read from the
+    file and handed to the scene, with no kinematics at all. Frame kinds come
+    from the file, so render() and play() (including dropping late tween
+    frames) work as usual."""
+
+    def __init__(self, baked, display, scene: MatrixScene):
+        super().__init__(baked, None, BodyParams(), display, scene)
+        self.frame_time = 1 / baked.fps
+        # Record for the current frame, -1 before the first
+        self.record = -1
+
+    def frames(self, start: int = 0, stop: int = None):
+        kinds = self.infile.kinds
+        if stop is None or stop > len(kinds):
+            stop = len(kinds)
+        # Records are only stored for frames that aren't repeats
+        self.record = -1
+        for frame in range(start):
+            if kinds[frame] != REPEAT_FRAME:
+                self.record += 1
+        for frame in range(start, stop):
+            kind = kinds[frame]
+            if kind != REPEAT_FRAME:
+                self.record += 1
+            if frame == start:
+                kind = NEW_FRAME
+            yield kind
+
+    def prepare_frame(self):
+        self.begin_phase("read")
+        endpoints = self.infile.read(self.record)
+        self.end_phase("read")
+        self.begin_phase("draw")
+        self.dirty = self.scene.update_endpoints(endpoints)
+        self.end_phase("draw")
+
+
+class StreamPlayer:
+    """Board side of pose_stream: draws the frames a host streams in. Frames
+    of segment endpoints go straight to the scene; frames of pose angles are
+    solved with body first (so body is only needed for those)."""
+
+    def __init__(self, receiver, display, scene: MatrixScene, body: Body = None):
+        self.receiver = receiver
+        self.display = display
+        self.scene = scene
+        self.body = body
+        self.body_params = BodyParams()
+        self.refreshes = 0
+        self.display.auto_refresh = False
+        self.display.root_group = scene.group
+
+    def poll(self) -> bool:
+        """Draws the latest frame if one arrived, returns whether one did"""
+        receiver = self.receiver
+        if not receiver.poll():
+            return False
+        if receiver.kind in (KEY_ENDPOINTS, DELTA_ENDPOINTS):
+            dirty = self.scene.update_endpoints(receiver.endpoints)
+        else:
+            for field, value in zip(PARAM_FIELDS, receiver.pose):
+                setattr(self.body_params, field, value)
+            self.body.update_params(self.body_params)
+            dirty = self.scene.update(self.body.segments, self.body.changed)
+        if dirty is not None:
+            self.display.refresh(minimum_frames_per_second=0)
+            self.refreshes += 1
+        return True
+
+
+if __name__ == "__main__":
+    # Desktop benchmark against the stand-in display: plays an animation
+    # as fast as possible and reports how much work the scene did
+    import sys
+    import timeline
+    from displayio_standin import Display, Group, Line
+    from profiler import Profiler
+
+    filename = sys.argv[1] if len(sys.argv) > 1 else "example.anim"
+    loops = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+
+    display = Display(64, 32)
+    scene = MatrixScene(Group(), Line)
+    body = Body(64, 32)
+    body_params = BodyParams()
+    animation = timeline.load(filename)
+
+    profiler = Profiler(report=False)
+    frames = 0
+    started = time.monotonic()
+    for loop in range(loops):
+        renderer = MatrixRenderer(animation, body, body_params, display, scene)
+        renderer.frame_time = 0
+        if loop == loops - 1:
+            renderer.profiler = profiler
+        frames += renderer.render()
+    elapsed = time.monotonic() - started
+
+    print(f"{frames} frames in {elapsed:.3f}s ({frames / elapsed:.0f} fps)")
+    print(f"{Line.created} lines created, {display.refresh_count} refreshes")
+    print(f"{display.refreshed_pixels / max(display.refresh_count, 1):.0f} pixels per refresh")
+    print("Last loop:")
+    profiler.print_summary()
+
+    # Same again from a baked copy (no kinematics on the playback side)
+    import io
+    from bake import bake, BakedAnimation
+
+    baked_file = io.BytesIO()
+    bake(animation, Body(64, 32), baked_file)
+    baked_file.seek(0)
+    baked = BakedAnimation(baked_file)
+    frames = 0
+    started = time.monotonic()
+    for loop in range(loops):
+        renderer = BakedRenderer(baked, display, scene)
+        renderer.frame_time = 0
+        frames += renderer.render()
+    elapsed = time.monotonic() - started
+    print(f"Baked: {frames} frames in {elapsed:.3f}s ({frames / elapsed:.0f} fps)")
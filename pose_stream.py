@@ -0,0 +1,514 @@
+import struct
+from array import array
+from binascii import crc32
+from stickman import PARAM_FIELDS
+from renderer import Renderer
+
+# Streaming poses from a host to the board over a serial-like byte stream
+# (usb_cdc.data on the board, a tty or a stand-in link on the desktop). The
+# host does the work and only sends what changed since the previous frame:
+# either baked-style segment endpoints (the board just draws them) or pose
+# angles (the board runs its own kinematics).
+#
+# Packet: SYNC (B), type (B), sequence (B), payload length (B), payload,
+# CRC-32 (I) of type to the end of the payload. The board also checks that a
+# payload's length and indexes fit its type before applying it, and treats
+# one that doesn't like a failed CRC.
+#
+#   KEY_ENDPOINTS    n (B), then n x [x0, y0, x1, y1] (h) for segments 0..n-1
+#   DELTA_ENDPOINTS  n (B), then n x [segment (B), x0, y0, x1, y1 (h)]
+#   KEY_POSE         n (B), then n floats (f), PARAM_FIELDS order
+#   DELTA_POSE       n (B), then n x [field index (B), value (f)]
+#   RESYNC           no payload, board -> host: send a keyframe
+#
+# Every frame packet takes the next sequence number (modulo 256). A delta only
+# applies on top of the frame right before it, so when the board sees a gap
+# in the sequence (or a corrupt packet) it ignores deltas until the next
+# keyframe and asks for one with RESYNC. The host also sends a keyframe every
+# keyframe_interval frames, for links that only go one way. A delta with no
+# changes still counts as a frame (the pose held for one more tick).
+
+SYNC = 0xA5
+
+KEY_ENDPOINTS = 1
+DELTA_ENDPOINTS = 2
+KEY_POSE = 3
+DELTA_POSE = 4
+RESYNC = 5
+
+_KEYFRAMES = (KEY_ENDPOINTS, KEY_POSE)
+# Bytes in a packet besides the payload: SYNC, type, sequence, length, CRC
+_OVERHEAD = 8
+# Payload bytes per item (after the count byte) for each frame type
+_ITEM_SIZES = {KEY_ENDPOINTS: 8, DELTA_ENDPOINTS: 9, KEY_POSE: 4, DELTA_POSE: 5}
+
+
+def encode_packet(kind: int, sequence: int, payload: bytes) -> bytes:
+    if len(payload) > 255:
+        raise ValueError(f"Payload of {len(payload)} bytes is too long")
+    header = bytes((kind, sequence & 0xFF, len(payload)))
+    checksum = crc32(payload, crc32(header)) & 0xFFFFFFFF
+    return bytes((SYNC,)) + header + payload + struct.pack("<I", checksum)
+
+
+def _checksum_ok(packet, length: int) -> bool:
+    """Whether packet (starting at SYNC, with a payload of length bytes) has a
+    good CRC"""
+    body = memoryview(packet)[1 : 4 + length]
+    expected = struct.unpack_from("<I", packet, 4 + length)[0]
+    return crc32(body) & 0xFFFFFFFF == expected
+
+
+class PoseStreamSender:
+    """Host side. Call send_endpoints() or send_pose() once per frame."""
+
+    def __init__(self, link, keyframe_interval: int = 50):
+        self.link = link
+        self.keyframe_interval = keyframe_interval
+        self.sequence = 0
+        self.since_keyframe = 0
+        self.last: list = None
+        self.resync = True
+        self.bytes_sent = 0
+        self.frames_sent = 0
+        self.keyframes_sent = 0
+        self.resync_requests = 0
+        self._incoming = bytearray()
+
+    def poll(self):
+        """Reads any RESYNC requests from the board"""
+        data = self.link.read(self.link.in_waiting) if self.link.in_waiting else None
+        if not data:
+            return
+        incoming = self._incoming
+        incoming.extend(data)
+        while len(incoming) >= _OVERHEAD:
+            if incoming[0] != SYNC or incoming[1] != RESYNC or incoming[3] != 0:
+                del incoming[0]
+                continue
+            if not _checksum_ok(incoming, 0):
+                del incoming[0]
+                continue
+            self.resync = True
+            self.resync_requests += 1
+            del incoming[:_OVERHEAD]
+
+    def _send(self, kind: int, payload: bytes):
+        packet = encode_packet(kind, self.sequence, payload)
+        self.link.write(packet)
+        self.sequence = (self.sequence + 1) & 0xFF
+        self.bytes_sent += len(packet)
+        self.frames_sent += 1
+
+    def _keyframe_due(self) -> bool:
+        self.poll()
+        if self.resync or self.last is None:
+            return True
+        return (
+            self.keyframe_interval > 0
+            and self.since_keyframe >= self.keyframe_interval
+        )
+
+    def _sent_keyframe(self, values: list):
+        self.last = values
+        self.resync = False
+        self.since_keyframe = 1
+        self.keyframes_sent += 1
+
+    def send_endpoints(self, values):
+        """values: x0, y0, x1, y1 for each segment (ints)"""
+        values = list(values)
+        segments = len(values) // 4
+        if self._keyframe_due() or len(self.last) != len(values):
+            payload = struct.pack(f"<B{len(values)}h", segments, *values)
+            self._send(KEY_ENDPOINTS, payload)
+            self._sent_keyframe(values)
+            return
+        last = self.last
+        payload = bytearray(1)
+        for segment in range(segments):
+            offset = segment * 4
+            if values[offset : offset + 4] != last[offset : offset + 4]:
+                payload += struct.pack("<B4h", segment, *values[offset : offset + 4])
+                payload[0] += 1
+        self._send(DELTA_ENDPOINTS, bytes(payload))
+        self.last = values
+        self.since_keyframe += 1
+
+    def send_pose(self, body_params):
+        values = [getattr(body_params, field) for field in PARAM_FIELDS]
+        if self._keyframe_due() or len(self.last) != len(values):
+            payload = struct.pack(f"<B{len(values)}f", len(values), *values)
+            self._send(KEY_POSE, payload)
+            # Compare against what the board decoded, not the exact floats
+            self._sent_keyframe(list(struct.unpack(f"<{len(values)}f", payload[1:])))
+            return
+        last = self.last
+        payload = bytearray(1)
+        for index, value in enumerate(values):
+            value = struct.unpack("<f", struct.pack("<f", value))[0]
+            if value != last[index]:
+                payload += struct.pack("<Bf", index, value)
+                payload[0] += 1
+                last[index] = value
+        self._send(DELTA_POSE, bytes(payload))
+        self.since_keyframe += 1
+
+
+class PoseStreamReceiver:
+    """Board side. Call poll() often; it returns True when a new frame has been
+    applied. The current frame is in endpoints (an array('h'), with changed[i]
+    saying which segments the last frame moved) or pose (a list of angles in
+    PARAM_FIELDS order), depending on what the host sends."""
+
+    def __init__(self, link, max_buffer: int = 512):
+        self.link = link
+        self.max_buffer = max_buffer
+        self.buffer = bytearray()
+        self.endpoints = array("h")
+        self.changed: list[bool] = []
+        self.pose: list[float] = [0.0] * len(PARAM_FIELDS)
+        # Type of the last frame applied (KEY_ENDPOINTS ... DELTA_POSE)
+        self.kind = None
+        self.sequence = None
+        self.synced = False
+        self.frames = 0
+        self.dropped = 0
+        self.corrupt = 0
+
+    def request_resync(self):
+        self.link.write(encode_packet(RESYNC, 0, b""))
+
+    def poll(self) -> bool:
+        """Applies every complete packet that has arrived, returns whether the
+        frame changed (or was held) since the last poll"""
+        waiting = self.link.in_waiting
+        if waiting:
+            data = self.link.read(waiting)
+            if data:
+                self.buffer.extend(data)
+        updated = False
+        buffer = self.buffer
+        while len(buffer) >= _OVERHEAD:
+            if buffer[0] != SYNC:
+                del buffer[0]
+                continue
+            length = buffer[3]
+            if len(buffer) < length + _OVERHEAD:
+                break
+            if not _checksum_ok(buffer, length):
+                # Not a real packet start (or damaged): look for the next one
+                self.corrupt += 1
+                del buffer[0]
+                self._lost()
+                continue
+            kind = buffer[1]
+            sequence = buffer[2]
+            payload = bytes(buffer[4 : 4 + length])
+            del buffer[: length + _OVERHEAD]
+            if self._apply(kind, sequence, payload):
+                updated = True
+        if len(buffer) > self.max_buffer:
+            del buffer[: len(buffer) - self.max_buffer]
+        return updated
+
+    def _lost(self):
+        if self.synced:
+            self.synced = False
+            self.request_resync()
+
+    def _valid(self, kind: int, payload: bytes) -> bool:
+        """Whether payload is well formed for kind: its length matches its
+        count and every segment or field index is in range"""
+        item_size = _ITEM_SIZES.get(kind)
+        if item_size is None or not payload:
+            return False
+        count = payload[0]
+        if len(payload) != 1 + count * item_size:
+            return False
+        if kind == KEY_POSE:
+            return count == len(PARAM_FIELDS)
+        if kind == DELTA_ENDPOINTS:
+            limit = len(self.changed)
+        elif kind == DELTA_POSE:
+            limit = len(PARAM_FIELDS)
+        else:
+            return True
+        for offset in range(1, len(payload), item_size):
+            if payload[offset] >= limit:
+                return False
+        return True
+
+    def _apply(self, kind: int, sequence: int, payload: bytes) -> bool:
+        if kind not in _ITEM_SIZES:
+            self.corrupt += 1
+            self._lost()
+            return False
+        if kind not in _KEYFRAMES:
+            if not self.synced:
+                self.dropped += 1
+                return False
+            if sequence != (self.sequence + 1) & 0xFF:
+                self.dropped += 1
+                self._lost()
+                return False
+        if not self._valid(kind, payload):
+            self.corrupt += 1
+            self._lost()
+            return False
+        self.sequence = sequence
+        self.synced = True
+        self.frames += 1
+        self.kind = kind
+
+        count = payload[0]
+        if kind == KEY_ENDPOINTS:
+            values = struct.unpack_from(f"<{count * 4}h", payload, 1)
+            if len(self.endpoints) != len(values):
+                self.endpoints = array("h", values)
+            else:
+                for index in range(len(values)):
+                    self.endpoints[index] = values[index]
+            self.changed = [True] * count
+        elif kind == DELTA_ENDPOINTS:
+            changed = self.changed
+            for index in range(len(changed)):
+                changed[index] = False
+            endpoints = self.endpoints
+            for item in range(count):
+                segment, x0, y0, x1, y1 = struct.unpack_from("<B4h", payload, 1 + item * 9)
+                offset = segment * 4
+                endpoints[offset] = x0
+                endpoints[offset + 1] = y0
+                endpoints[offset + 2] = x1
+                endpoints[offset + 3] = y1
+                changed[segment] = True
+        elif kind == KEY_POSE:
+            self.pose = list(struct.unpack_from(f"<{count}f", payload, 1))
+        elif kind == DELTA_POSE:
+            for item in range(count):
+                index, value = struct.unpack_from("<Bf", payload, 1 + item * 5)
+                self.pose[index] = value
+        return True
+
+
+class StreamRenderer(Renderer):
+    """Host side renderer: plays a script and sends every frame to the board,
+    as segment endpoints for body (endpoints=True) or as pose angles. Use
+    play() to send in real time, render() sends as fast as the link takes it."""
+
+    def __init__(self, infile, body, body_params, sender, endpoints: bool = True):
+        super().__init__(infile, body, body_params)
+        self.sender = sender
+        self.endpoints = endpoints
+        self.values = [0] * (len(body.segments) * 4)
+
+    def render_frame(self):
+        self.prepare_frame()
+        self.present_frame()
+
+    def prepare_frame(self):
+        if not self.endpoints:
+            return
+        self.body.update_params(self.body_params)
+        values = self.values
+        for index, segment in enumerate(self.body.segments):
+            offset = index * 4
+            values[offset] = int(segment.start.x)
+            values[offset + 1] = int(segment.start.y)
+            values[offset + 2] = int(segment.end.x)
+            values[offset + 3] = int(segment.end.y)
+
+    def present_frame(self):
+        if self.endpoints:
+            self.sender.send_endpoints(self.values)
+        else:
+            self.sender.send_pose(self.body_params)
+
+    def render_last_frame(self):
+        # Nothing changed: an empty delta (or a keyframe if one is due)
+        self.present_frame()
+
+    def prepare_repeat(self):
+        # present_frame() sends the unchanged frame again
+        pass
+
+
+class LoopbackLink:
+    """In-memory stand-in for a serial link, one end of a pair made by
+    loopback_pair(). drop and corrupt (0..1) damage that share of the writes
+    from this end, to exercise resyncing."""
+
+    def __init__(self, drop: float = 0.0, corrupt: float = 0.0, seed: int = 0):
+        self.incoming = bytearray()
+        self.peer: LoopbackLink = None
+        self.drop = drop
+        self.corrupt = corrupt
+        self._random = None
+        if drop or corrupt:
+            import random
+
+            self._random = random.Random(seed)
+
+    @property
+    def in_waiting(self) -> int:
+        return len(self.incoming)
+
+    def read(self, count: int) -> bytes:
+        data = bytes(self.incoming[:count])
+        del self.incoming[:count]
+        return data
+
+    def write(self, data: bytes) -> int:
+        if self._random is not None:
+            if self._random.random() < self.drop:
+                return len(data)
+            if self._random.random() < self.corrupt:
+                data = bytearray(data)
+                data[self._random.randrange(len(data))] ^= 0xFF
+        self.peer.incoming.extend(data)
+        return len(data)
+
+
+def loopback_pair(drop: float = 0.0, corrupt: float = 0.0) -> (LoopbackLink, LoopbackLink):
+    """(host end, board end). The damage only applies host -> board."""
+    host = LoopbackLink(drop, corrupt)
+    board = LoopbackLink()
+    host.peer = board
+    board.peer = host
+    return host, board
+
+
+class FdLink:
+    """A link over a file descriptor (tty, pty or pipe) in non-blocking mode,
+    for the desktop"""
+
+    def __init__(self, fd: int):
+        import os
+        import select
+
+        self.fd = fd
+        self._os = os
+        self._select = select
+        os.set_blocking(fd, False)
+        self._pending = b""
+
+    @property
+    def in_waiting(self) -> int:
+        if not self._pending:
+            try:
+                self._pending = self._os.read(self.fd, 4096)
+            except BlockingIOError:
+                pass
+        return len(self._pending)
+
+    def read(self, count: int) -> bytes:
+        data = self._pending[:count]
+        self._pending = self._pending[count:]
+        return data
+
+    def write(self, data: bytes) -> int:
+        view = memoryview(data)
+        while view:
+            try:
+                written = self._os.write(self.fd, view)
+            except BlockingIOError:
+                # Full: wait until the other end has read some
+                self._select.select([], [self.fd], [])
+                continue
+            view = view[written:]
+        return len(data)
+
+
+def pty_pair() -> (FdLink, FdLink):
+    """(host end, board end) of a pseudo terminal in raw mode, the closest
+    desktop stand-in for the USB serial link"""
+    import os
+    import tty
+
+    host, board = os.openpty()
+    tty.setraw(board)
+    return FdLink(host), FdLink(board)
+
+
+if __name__ == "__main__":
+    import argparse
+    import asyncio
+    import os
+    import time
+    from stickman import Body, BodyParams
+    import timeline
+
+    parser = argparse.ArgumentParser(description="Stream a .anim script to the board")
+    parser.add_argument("infile", help=".anim script")
+    parser.add_argument(
+        "--device", help="serial device of the board (default: loopback test)"
+    )
+    parser.add_argument(
+        "--pose",
+        action="store_true",
+        help="send pose angles (the board solves them) instead of endpoints",
+    )
+    parser.add_argument("--size", default="64x32", help="display WIDTHxHEIGHT")
+    parser.add_argument("--keyframes", type=int, default=50, help="keyframe interval")
+    parser.add_argument("--drop", type=float, default=0.0, help="loopback packet loss")
+    parser.add_argument("--corrupt", type=float, default=0.0, help="loopback damage")
+    args = parser.parse_args()
+
+    width, height = (int(value) for value in args.size.split("x"))
+    animation = timeline.load(args.infile)
+    body = Body(width, height)
+
+    if args.device:
+        import tty
+
+        fd = os.open(args.device, os.O_RDWR | os.O_NOCTTY)
+        tty.setraw(fd)
+        sender = PoseStreamSender(FdLink(fd), args.keyframes)
+        renderer = StreamRenderer(
+            animation, body, BodyParams(), sender, endpoints=not args.pose
+        )
+        try:
+            while True:
+                renderer.body_params = BodyParams()
+                asyncio.run(renderer.play())
+                print(
+                    f"Sent {sender.frames_sent} frames, {sender.bytes_sent} bytes,"
+                    f" {sender.resync_requests} resync requests"
+                )
+        except KeyboardInterrupt:
+            pass
+    else:
+        # Host and board in one process over a stand-in link, drawing on the
+        # stand-in display, to check the protocol and measure the bandwidth
+        from displayio_standin import Display, Group, Line
+        from matrix_renderer import MatrixScene, StreamPlayer
+
+        host_link, board_link = loopback_pair(args.drop, args.corrupt)
+        sender = PoseStreamSender(host_link, args.keyframes)
+        receiver = PoseStreamReceiver(board_link)
+        player = StreamPlayer(
+            receiver, Display(width, height), MatrixScene(Group(), Line), body
+        )
+        class LoopbackRenderer(StreamRenderer):
+            # The board draws each frame as soon as it has been sent
+            def present_frame(self):
+                super().present_frame()
+                player.poll()
+
+        renderer = LoopbackRenderer(
+            animation, Body(width, height), BodyParams(), sender, not args.pose
+        )
+        started = time.perf_counter()
+        frames = renderer.render()
+        elapsed = time.perf_counter() - started
+        full_frame = len(encode_packet(KEY_ENDPOINTS, 0, bytes(1 + len(body.segments) * 8)))
+        print(
+            f"{frames} frames: {sender.bytes_sent} bytes sent"
+            f" ({sender.bytes_sent / frames:.1f} per frame, full frames are {full_frame})"
+        )
+        print(
+            f"{sender.keyframes_sent} keyframes, {sender.resync_requests} resync"
+            f" requests, {receiver.dropped} packets ignored, {receiver.corrupt} corrupt"
+        )
+        print(f"{player.refreshes} refreshes in {elapsed:.3f}s")
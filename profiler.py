@@ -0,0 +1,142 @@
+try:
+    from time import monotonic_ns
+except ImportError:
+    from time import monotonic
+
+    def monotonic_ns() -> int:
+        return int(monotonic() * 1000000000)
+
+# Optional per-phase timing for Renderer. Hand a Profiler to a renderer
+# (renderer.profiler = Profiler()) and render() records, for every frame, how
+# long was spent in each phase:
+#
+#   parse       reading the next line/event of the script
+#   tween       computing the next in-between pose
+#   kinematics  Body.update_params (renderers that call it themselves)
+#   draw        drawing/showing the frame
+#   refresh     pushing a prepared frame to the display (MatrixRenderer)
+#   wait        wait_for_frame
+#
+# plus every frame that missed its real-time deadline and by how much. At the
+# end of render() (or play()) a summary is printed; write_trace() saves the raw timings in
+# Chrome's trace event format (chrome://tracing, Perfetto).
+
+
+class Profiler:
+    def __init__(self, report: bool = True):
+        self.report = report
+        self.frame = 0
+        # (phase, frame, start ns, duration ns) for every timed phase
+        self.records = []
+        # phase -> [total ns, count, max ns]
+        self.totals = {}
+        # (frame, lateness in seconds, ns timestamp) for every missed deadline
+        self.missed = []
+        self._started = {}
+
+    def start(self, phase: str):
+        self._started[phase] = monotonic_ns()
+
+    def stop(self, phase: str):
+        now = monotonic_ns()
+        started = self._started.pop(phase, None)
+        if started is None:
+            return
+        duration = now - started
+        self.records.append((phase, self.frame, started, duration))
+        total = self.totals.get(phase)
+        if total is None:
+            self.totals[phase] = [duration, 1, duration]
+        else:
+            total[0] += duration
+            total[1] += 1
+            if duration > total[2]:
+                total[2] = duration
+
+    def timed(self, phase: str, iterator):
+        """Wraps an iterator so that each step is timed as phase"""
+        iterator = iter(iterator)
+        while True:
+            self.start(phase)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self._started.pop(phase, None)
+                return
+            self.stop(phase)
+            yield item
+
+    def end_frame(self):
+        self.frame += 1
+
+    def missed_deadline(self, lateness: float):
+        self.missed.append((self.frame, lateness, monotonic_ns()))
+
+    def summary(self) -> dict:
+        phases = {}
+        for phase, (total, count, longest) in self.totals.items():
+            phases[phase] = {
+                "total": total / 1e9,
+                "mean": total / count / 1e9,
+                "max": longest / 1e9,
+                "count": count,
+            }
+        lateness = [late for frame, late, when in self.missed]
+        return {
+            "frames": self.frame,
+            "phases": phases,
+            "missed_deadlines": len(lateness),
+            "mean_lateness": sum(lateness) / len(lateness) if lateness else 0.0,
+            "max_lateness": max(lateness) if lateness else 0.0,
+        }
+
+    def print_summary(self):
+        summary = self.summary()
+        print(f"Profiled {summary['frames']} frames")
+        for phase, timing in summary["phases"].items():
+            print(
+                f"  {phase:<11} total {timing['total'] * 1000:9.2f}ms"
+                f"  mean {timing['mean'] * 1000:7.3f}ms"
+                f"  max {timing['max'] * 1000:7.3f}ms"
+            )
+        if summary["missed_deadlines"]:
+            print(
+                f"  missed {summary['missed_deadlines']} deadlines,"
+                f" mean {summary['mean_lateness'] * 1000:.2f}ms"
+                f" max {summary['max_lateness'] * 1000:.2f}ms late"
+            )
+
+    def end_render(self):
+        """Called by Renderer at the end of render()"""
+        if self.report:
+            self.print_summary()
+
+    def write_trace(self, filename: str):
+        import json
+
+        events = [
+            {
+                "name": phase,
+                "ph": "X",
+                "ts": started / 1000,
+                "dur": duration / 1000,
+                "pid": 0,
+                "tid": 0,
+                "args": {"frame": frame},
+            }
+            for phase, frame, started, duration in self.records
+        ]
+        for frame, lateness, when in self.missed:
+            events.append(
+                {
+                    "name": "missed deadline",
+                    "ph": "i",
+                    "ts": when / 1000,
+                    "pid": 0,
+                    "tid": 0,
+                    "s": "t",
+                    "args": {"frame": frame, "late_ms": lateness * 1000},
+                }
+            )
+        with open(filename, "w") as outfile:
+            json.dump({"traceEvents": events}, outfile)
@@ -0,0 +1,88 @@
+import select
+from PIL import Image
+
+# Pixel formats for RawFrameWriter: name -> (Pillow mode, bytes per pixel,
+# ffmpeg -pix_fmt)
+FORMATS = {
+    "rgb": ("RGB", 3, "rgb24"),
+    "rgbx": ("RGBX", 4, "rgb0"),
+    "gray": ("L", 1, "gray"),
+}
+
+
+class RawFrameWriter:
+    """Writes frames to fp as bare pixels, one after another with no header:
+    height rows of stride bytes each (stride defaults to width x bytes per
+    pixel, any extra is zero padding). Meant for piping into an external
+    encoder, e.g.
+
+      python render_animation.py example.anim - --raw rgb | \\
+          ffmpeg -f rawvideo -pix_fmt rgb24 -s 500x500 -r 10 -i - out.mp4
+
+    Frames are written through a memoryview, sliced (not copied) when the
+    file takes less than a whole frame at once. A Pillow image has to be
+    packed out of Pillow's internal layout once (tobytes); frames that are
+    already raw pixels (any buffer, e.g. stickman_np.Framebuffer.buffer()) are
+    written straight from their memory with no copy at all.
+
+    Nothing is queued: add_frame() returns once the frame has been handed to
+    fp, so with a pipe a slow reader blocks the renderer (back-pressure) and
+    memory use stays at one frame."""
+
+    # Raw video has no loop count, only here so PILRenderer can set one
+    loop = None
+
+    def __init__(self, fp, pixel_format: str = "rgb", stride: int = None):
+        if pixel_format not in FORMATS:
+            raise ValueError(
+                f"Unknown pixel format {pixel_format} (use one of {', '.join(FORMATS)})"
+            )
+        self.fp = fp
+        self.pixel_format = pixel_format
+        self.mode, self.bytes_per_pixel, self.ffmpeg_format = FORMATS[pixel_format]
+        self.stride = stride
+        self.size: (int, int) = None
+        self.frame_count = 0
+        self.bytes_written = 0
+
+    def _set_size(self, size: (int, int)):
+        self.size = size
+        row_bytes = size[0] * self.bytes_per_pixel
+        if self.stride is None:
+            self.stride = row_bytes
+        elif self.stride < row_bytes:
+            raise ValueError(f"Stride {self.stride} is less than a row ({row_bytes})")
+
+    def frame_bytes(self) -> int:
+        return self.stride * self.size[1] if self.size is not None else 0
+
+    def add_frame(self, image, duration: float = None):
+        """Writes one frame. The duration is ignored, raw video has a fixed
+        frame rate (repeat a frame to hold it)."""
+        if not isinstance(image, Image.Image):
+            self._write(memoryview(image).cast("B"))
+            return
+
+        if self.size is None:
+            self._set_size(image.size)
+        elif image.size != self.size:
+            raise ValueError(f"Frame size {image.size} doesn't match {self.size}")
+        if image.mode != self.mode:
+            image = image.convert(self.mode)
+        self._write(memoryview(image.tobytes("raw", self.mode, self.stride)))
+
+    def _write(self, view: memoryview):
+        # Unbuffered files and pipes may take only part of a frame at a time
+        offset = 0
+        while offset < len(view):
+            written = self.fp.write(view[offset:])
+            if written is None:
+                # Non-blocking and full: wait for the reader to catch up
+                select.select([], [self.fp], [])
+                continue
+            offset += written
+        self.bytes_written += offset
+        self.frame_count += 1
+
+    def close(self):
+        self.fp.flush()
@@ -1,41 +1,223 @@
+import argparse
 import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from PIL import Image
 from stickman import Body, BodyParams
-from stickman_pil import make_pil_frame
+from stickman_pil import (
+    make_pil_frame,
+    make_pil_frames,
+    pose_tuple,
+    BodyPalette,
+    FrameCache,
+)
+from gif_writer import StreamingGifWriter, coalesce
+from raw_writer import RawFrameWriter, FORMATS
+from profiler import Profiler
 from renderer import Renderer
+import timeline
+
+# Most frames a worker draws (and sends back) in one go
+MAX_CHUNK_FRAMES = 16
 
 
 class PILRenderer(Renderer):
-    def __init__(self, infile, body: Body, body_params: BodyParams):
+    def __init__(
+        self,
+        infile,
+        body: Body,
+        body_params: BodyParams,
+        frame_cache: FrameCache = None,
+        workers: int = 1,
+        stream: StreamingGifWriter | RawFrameWriter = None,
+        palette: BodyPalette = None,
+    ):
+        """With workers > 1, render() only records the pose of each frame and
+        then draws them all in a process pool at the end (frame_cache is not
+        used in that case).
+
+        With a stream, frames are written to it as they are produced instead of
+        being kept in results (the caller closes the stream).
+
+        With a palette, frames are drawn as "P" images using it rather than
+        "RGB", so the GIF encoder doesn't have to quantize them."""
         super().__init__(infile, body, body_params)
         self.results: [Image] = []
+        self.frame_cache = frame_cache
+        self.workers = workers
+        self.stream = stream
+        self.palette = palette
+        self.last_image: Image = None
+        # (scale, pose) for each frame still to be drawn, None for a repeat
+        self.pending: list = []
 
     def render_frame(self):
-        self.results.append(make_pil_frame(self.body, self.body_params))
+        if self.workers > 1:
+            self.pending.append(
+                (self.body.overall_scale_factor, pose_tuple(self.body_params))
+            )
+            return
+        self.begin_phase("kinematics")
+        self.body.update_params(self.body_params)
+        self.end_phase("kinematics")
+        # make_pil_frame's own update_params is then a no-op
+        self.begin_phase("draw")
+        image = make_pil_frame(
+            self.body, self.body_params, self.frame_cache, self.palette
+        )
+        self.end_phase("draw")
+        self.emit(image)
 
     def render_last_frame(self):
-        self.results.append(self.results[-1])
+        if self.workers > 1:
+            self.pending.append(None)
+            return
+        self.emit(self.last_image)
+
+    def frame_duration(self) -> float:
+        """How long each frame is shown, in milliseconds"""
+        return 1000 / self.config.get("fps", 10)
+
+    def emit(self, image: Image):
+        """Hands a finished frame to the stream, or keeps it in results"""
+        if self.stream is not None:
+            if self.stream.frame_count == 0:
+                self.stream.loop = int(self.config.get("loop", 0))
+            self.begin_phase("encode")
+            self.stream.add_frame(image, self.frame_duration())
+            self.end_phase("encode")
+        else:
+            self.results.append(image)
+        self.last_image = image
+
+    def finish(self):
+        if self.pending:
+            self.rasterize_pending()
+
+    def rasterize_pending(self):
+        """Draws the recorded frames in chunks across the worker pool and
+        emits them in order as the chunks come back"""
+        frames = [frame for frame in self.pending if frame is not None]
+        # A few chunks per worker keeps them all busy without pickling per
+        # frame; capped so the frames held at once don't grow with the length
+        chunk_size = -(-len(frames) // (self.workers * 4))
+        chunk_size = max(1, min(MAX_CHUNK_FRAMES, chunk_size))
+        draw_chunk = partial(
+            make_pil_frames,
+            self.body.width,
+            self.body.height,
+            palette=self.palette,
+        )
+        with ProcessPoolExecutor(self.workers) as pool:
+            drawn = self._drawn_frames(pool, draw_chunk, frames, chunk_size)
+            for frame in self.pending:
+                if frame is None:
+                    self.emit(self.last_image)
+                else:
+                    self.emit(next(drawn))
+        self.pending = []
 
-    def write_animated_gif(self, filename: str):
-        fps = self.config.get("fps", 10)
+    def _drawn_frames(self, pool, draw_chunk, frames: list, chunk_size: int):
+        # Only a couple of chunks per worker are in flight (or waiting to be
+        # emitted) at a time, so memory doesn't grow with the animation
+        in_flight = deque()
+        for start in range(0, len(frames), chunk_size):
+            chunk = frames[start : start + chunk_size]
+            in_flight.append(pool.submit(draw_chunk, chunk))
+            if len(in_flight) >= self.workers * 2:
+                yield from in_flight.popleft().result()
+        while in_flight:
+            yield from in_flight.popleft().result()
+
+    def write_animated_gif(self, filename):
+        """Saves results as a GIF to filename (or an open binary file)"""
         loop = int(self.config.get("loop", 0))
-        duration = 1/fps
+        duration = self.frame_duration()
         print(f"Duration is {duration} and loop is {loop}")
         if len(self.results) > 0:
-            self.results[0].save(
-                filename, save_all=True, append_images=self.results[1:], duration=duration, loop=loop
+            # Repeats and holds become one frame shown for longer
+            images, durations = coalesce(self.results, duration)
+            images[0].save(
+                filename,
+                format="GIF",
+                save_all=True,
+                append_images=images[1:],
+                duration=durations,
+                loop=loop,
             )
 
 
+def open_output(filename: str, buffering: int = -1):
+    """Opens filename for writing, - meaning stdout (and then every message
+    printed goes to stderr instead, to keep it out of the output)"""
+    if filename == "-":
+        outfile = open(sys.stdout.fileno(), "wb", buffering=buffering, closefd=False)
+        sys.stdout = sys.stderr
+        return outfile
+    return open(filename, "wb", buffering=buffering)
+
+
 if __name__ == "__main__":
-    if len(sys.argv) > 1:
-        infile = open(sys.argv[1])
+    parser = argparse.ArgumentParser(description="Render a .anim script to an animated GIF")
+    parser.add_argument("infile", nargs="?", help=".anim script (default: stdin)")
+    parser.add_argument(
+        "outfile",
+        nargs="?",
+        default="animation.gif",
+        help="output file or named pipe, - for stdout (default: animation.gif)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="draw frames in this many worker processes (default: 1, no pool)",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="write each frame as it is drawn, storing only what changed",
+    )
+    parser.add_argument(
+        "--palette",
+        action="store_true",
+        help="draw palette frames with one global color table (no quantizing)",
+    )
+    parser.add_argument(
+        "--raw",
+        choices=FORMATS,
+        help="write raw frames in this pixel format instead of a GIF",
+    )
+    parser.add_argument(
+        "--stride",
+        type=int,
+        help="bytes per row of a raw frame (default: no padding)",
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="TRACE",
+        help="print per-phase timings and save them as a Chrome trace file",
+    )
+    parser.add_argument(
+        "--frames",
+        metavar="START:STOP",
+        help="only render this range of frames (either end can be left out)",
+    )
+    args = parser.parse_args()
+
+    start, stop = 0, None
+    if args.frames:
+        first, _, last = args.frames.partition(":")
+        start = int(first) if first else 0
+        stop = int(last) if last else None
+
+    if args.infile:
+        # Uses (and refreshes) the compiled copy next to the script
+        infile = timeline.load(args.infile)
     else:
         infile = sys.stdin
 
-    if len(sys.argv) > 2:
-        outfilename = sys.argv[2]
-    else:
-        outfilename = "animation.gif"
+    outfilename = args.outfile
 
     width = 500
     height = 500
@@ -45,6 +227,65 @@ if __name__ == "__main__":
     body = Body(width, height)
     tween_count = 0
 
-    renderer = PILRenderer(infile, body, body_params)
-    renderer.render()
-    renderer.write_animated_gif(outfilename)
+    frame_cache = FrameCache()
+    palette = BodyPalette(body) if args.palette else None
+    # Reported after encoding, so the encode time is included
+    profiler = Profiler(report=False) if args.profile else None
+    if args.raw:
+        # Unbuffered, so frames go from their memoryview straight to the fd
+        outfile = open_output(outfilename, buffering=0)
+        stream = RawFrameWriter(outfile, args.raw, args.stride)
+        renderer = PILRenderer(
+            infile, body, body_params, frame_cache, args.workers, stream, palette
+        )
+        renderer.profiler = profiler
+        try:
+            renderer.render(start, stop)
+            stream.close()
+        except BrokenPipeError:
+            # The reader went away, nothing left to write to
+            pass
+        finally:
+            outfile.close()
+        print(
+            f"Wrote {stream.frame_count} {width}x{height} frames"
+            f" ({stream.bytes_written} bytes, -pix_fmt {stream.ffmpeg_format},"
+            f" stride {stream.stride}) to {outfilename}"
+        )
+    elif args.stream:
+        outfile = open_output(outfilename)
+        stream = StreamingGifWriter(
+            outfile, palette=palette.image() if palette is not None else None
+        )
+        renderer = PILRenderer(
+            infile, body, body_params, frame_cache, args.workers, stream, palette
+        )
+        renderer.profiler = profiler
+        try:
+            renderer.render(start, stop)
+            stream.close()
+        except BrokenPipeError:
+            pass
+        finally:
+            outfile.close()
+        print(f"Streamed {stream.frame_count} frames to {outfilename}")
+    else:
+        # Opened first, so nothing printed while rendering ends up in it
+        outfile = open_output(outfilename) if outfilename == "-" else None
+        renderer = PILRenderer(
+            infile, body, body_params, frame_cache, args.workers, palette=palette
+        )
+        renderer.profiler = profiler
+        renderer.render(start, stop)
+        renderer.begin_phase("encode")
+        if outfile is not None:
+            with outfile:
+                renderer.write_animated_gif(outfile)
+        else:
+            renderer.write_animated_gif(outfilename)
+        renderer.end_phase("encode")
+    if args.workers <= 1:
+        print(f"Frame cache: {frame_cache.stats()}")
+    if profiler is not None:
+        profiler.print_summary()
+        profiler.write_trace(args.profile)
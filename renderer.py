@@ -1,5 +1,18 @@
-from stickman import Body, BodyParams
-from tweener import produce_tweens
+from stickman import Body, BodyParams, PARAM_FIELDS
+from tweener import iter_tweens
+from timeline import (
+    Timeline,
+    FrameIndex,
+    NEW_FRAME,
+    REPEAT_FRAME,
+    TWEEN_FRAME,
+    parse_script,
+    parse_params,
+    parse_options,
+    REPEAT,
+    TWEEN,
+    OPTIONS,
+)
 
 try:
     import copy 
@@ -9,10 +22,21 @@ except ImportError:
 
 class Renderer:
     def __init__(self, infile, body: Body, body_params: BodyParams):
+        """infile is either an open text .anim script (any iterable of lines)
+        or a compiled timeline.Timeline"""
         self.infile = infile
         self.body = body
         self.body_params = body_params
         self.config={}
+        # The pose before the first frame, for frame_index() (body_params
+        # itself changes as the script plays)
+        self.start_params = copy.deepcopy(body_params)
+        # Reused for every in-between pose of a tween
+        self.tween_buffer = copy.deepcopy(body_params)
+        # Optional profiler.Profiler
+        self.profiler = None
+        # timeline.FrameIndex, built the first time a frame range is rendered
+        self.index = None
 
     def render_frame(self):
         """Return an object that represents a rendered frame."""
@@ -21,66 +45,210 @@ class Renderer:
     def render_last_frame(self):
         raise NotImplemented
 
+    def finish(self):
+        """Called once every frame has been shown (end of render() or play()),
+        for work that has to wait for the whole animation"""
+        pass
+
+    def prepare_frame(self):
+        """For play(): do all the work for the frame in body_params without
+        showing it yet. The default just renders it."""
+        self.render_frame()
+
+    def prepare_repeat(self):
+        """For play(): prepare_frame() for a repeat of the last frame. The
+        default just renders it with render_last_frame()."""
+        self.render_last_frame()
+
+    def present_frame(self):
+        """For play(): show the frame prepared last (at its deadline)"""
+        pass
+
     def wait_for_frame(self):
         """If you need to render in real time, use this to wait for the next
         time tick. Otherwise ignore this"""
         pass
 
+    def begin_phase(self, phase: str):
+        """Subclasses mark their own phases (e.g. "kinematics", "draw") with
+        begin_phase/end_phase; both do nothing unless profiling"""
+        if self.profiler is not None:
+            self.profiler.start(phase)
+
+    def end_phase(self, phase: str):
+        if self.profiler is not None:
+            self.profiler.stop(phase)
+
+    def show_frame(self, repeat: bool):
+        """Waits for the next tick and then renders (or repeats) a frame"""
+        profiler = self.profiler
+        if profiler is None:
+            self.wait_for_frame()
+            if repeat:
+                self.render_last_frame()
+            else:
+                self.render_frame()
+            return
+
+        profiler.start("wait")
+        self.wait_for_frame()
+        profiler.stop("wait")
+        if repeat:
+            self.render_last_frame()
+        else:
+            self.render_frame()
+        profiler.end_frame()
+
+    def update_params(self, orig, params):
+        for index, value in params:
+            setattr(orig, PARAM_FIELDS[index], value)
+
+    def update_options(self, options):
+        for name, value in options:
+            if name == "scale":
+                self.body.set_scale_factor(value)
+            self.config[name] = value
+
     def update_params_from_line(self, orig, line):
-        params = line.split(",")
-        for param in params:
-            param = param.strip()
-            (name, value) = param.split("=")
-            setattr(orig, name, float(value))
+        self.update_params(orig, parse_params(line))
     
     def update_options_from_line(self, line):
-        params = line.split(",")
-        for param in params:
-            param = param.strip()
-            (name, value) = param.split("=")
-            if name == "scale":
-                self.config[name] = float(value)
-                self.body.set_scale_factor(float(value))
-            if value.startswith('"'):
-                self.config[name] = value
-            else:
-                self.config[name] = float(value)
+        self.update_options(parse_options(line))
+
+    def events(self):
+        if isinstance(self.infile, Timeline):
+            return self.infile.events
+        return parse_script(self.infile)
+
+    def frame_index(self) -> FrameIndex:
+        """Index of the whole script, starting from the initial body_params"""
+        if self.index is None:
+            self.index = FrameIndex(self.events(), self.start_params)
+        return self.index
+
+    def frames(self, start: int = 0, stop: int = None):
+        """Plays the script: sets body_params for each frame in turn and yields
+        what kind of frame it is (NEW_FRAME, REPEAT_FRAME or TWEEN_FRAME).
+        A range other than the whole script seeks with frame_index() instead
+        of playing everything before start."""
+        if start != 0 or stop is not None:
+            yield from self.indexed_frames(start, stop)
+            return
 
-    def render(self) -> int:
         count = 0
-        for line in self.infile:
-            line = line.strip()
-            if line.startswith("#") or line == "":
-                continue
-            elif line.startswith("*"):
-                repetitions = int(line[1:])
-                for repeat in range(repetitions):
-                    self.wait_for_frame()
-                    if count == 0:
-                        self.render_frame()
-                        count += 1
-                    else:
-                        self.render_last_frame()
-                        count += 1
-            elif line.startswith(">"):
-                tween_count = int(line[1:])
-            elif line.startswith("!"):
-                self.update_options_from_line(line[1:])
+        tween_count = 0
+        events = self.events()
+        if self.profiler is not None:
+            events = self.profiler.timed("parse", events)
+        for op, arg in events:
+            if op == REPEAT:
+                for repeat in range(arg):
+                    yield REPEAT_FRAME if count > 0 else NEW_FRAME
+                    count += 1
+            elif op == TWEEN:
+                tween_count = arg
+            elif op == OPTIONS:
+                self.update_options(arg)
             else:
                 if tween_count > 0:
-                    start = copy.deepcopy(self.body_params)
+                    start = self.body_params
                     end = copy.deepcopy(self.body_params)
-                    self.update_params_from_line(end, line)
-                    for position in produce_tweens(start, end, tween_count):
+                    self.update_params(end, arg)
+                    tweens = iter_tweens(start, end, tween_count, self.tween_buffer)
+                    if self.profiler is not None:
+                        tweens = self.profiler.timed("tween", tweens)
+                    step = 0
+                    for position in tweens:
                         self.body_params = position
-                        self.wait_for_frame()
-                        self.render_frame()
+                        step += 1
+                        # The last step lands on the keyframe itself
+                        yield TWEEN_FRAME if step < tween_count else NEW_FRAME
                         count += 1
                     self.body_params = end
                     tween_count = 0
                 else:
-                    self.update_params_from_line(self.body_params, line)
-                    self.wait_for_frame()
-                    self.render_frame()
+                    self.update_params(self.body_params, arg)
+                    yield NEW_FRAME
                     count += 1
+
+    def indexed_frames(self, start: int, stop: int = None):
+        index = self.frame_index()
+        self.body_params = copy.deepcopy(self.body_params)
+        options = None
+        first = True
+        for frame, kind, pose, frame_options in index.frames(
+            start, stop, self.body_params
+        ):
+            if frame_options is not options:
+                options = frame_options
+                self.update_options(options)
+            # Nothing has been drawn yet to repeat
+            yield NEW_FRAME if first else kind
+            first = False
+
+    def render(self, start: int = 0, stop: int = None) -> int:
+        """Renders frames start..stop-1 (all of them by default), returns how
+        many were rendered"""
+        count = 0
+        for kind in self.frames(start, stop):
+            self.show_frame(kind == REPEAT_FRAME)
+            count += 1
+        self.finish()
+        if self.profiler is not None:
+            self.profiler.end_render()
         return count
+
+    async def play(self, frame_time: float = None) -> (int, int):
+        """Real-time version of render() for asyncio (desktop or CircuitPython).
+
+        Frames are scheduled against absolute deadlines (start + n *
+        frame_time, 1/fps by default, where start is when the first frame is
+        ready) rather than a sleep per frame, and each one is prepared as soon
+        as the previous one is on screen, so only
+        present_frame() is left for its deadline. When playback falls behind,
+        in-between tween frames whose deadline has already passed are dropped
+        without being prepared. Returns (frames shown, frames skipped)."""
+        import asyncio
+        from time import monotonic
+
+        if frame_time is None:
+            frame_time = 1 / self.config.get("fps", 10)
+        profiler = self.profiler
+        shown = 0
+        skipped = 0
+        start = None
+        index = 0
+        for kind in self.frames():
+            if start is not None:
+                deadline = start + index * frame_time
+                if kind == TWEEN_FRAME and monotonic() > deadline:
+                    index += 1
+                    skipped += 1
+                    continue
+
+            if kind == REPEAT_FRAME:
+                self.prepare_repeat()
+            else:
+                self.prepare_frame()
+            if start is None:
+                # The clock starts once the first frame is ready to show
+                start = deadline = monotonic()
+            index += 1
+            wait_time = deadline - monotonic()
+            if wait_time > 0:
+                await asyncio.sleep(wait_time)
+            else:
+                # (The first frame is shown as soon as it's ready, not late)
+                if profiler is not None and index > 1:
+                    profiler.missed_deadline(-wait_time)
+                # Let other tasks run even when behind
+                await asyncio.sleep(0)
+            self.present_frame()
+            shown += 1
+            if profiler is not None:
+                profiler.end_frame()
+
+        self.finish()
+        if profiler is not None:
+            profiler.end_render()
+        return shown, skipped
@@ -1,4 +1,5 @@
 import math
+from array import array
 
 
 # Eventually I think we'll want a two pass ordered by Z where we compute the
@@ -14,18 +15,18 @@ import math
 
 
 class Point:
+    __slots__ = ("x", "y")
+
     def __init__(self, x:int, y:int):
         self.x = x
         self.y = y
 
-    x: int = 0
-    y: int = 0
-
     def to_tuple(self) -> (int, int):
         return (self.x, self.y)
 
 
 class Segment:
+    __slots__ = ("start", "end", "length", "angle", "z_order")
 
     def __init__(self, start:Point, end:Point, length:float, angle:float, z_order: float):
         self.start = start
@@ -50,6 +51,16 @@ class Segment:
         end_y = start.y - length * math.cos(rotation_rad)
         return cls(start, Point(end_x, end_y), length, rotation, z_order)
 
+    def update(self, length: float, rotation: float):
+        """Same as from_point, but moves this segment's end point in place
+        (start is expected to be shared with the segment it hangs off)"""
+        rotation_rad = math.radians(rotation)
+        end = self.end
+        end.x = self.start.x + length * math.sin(rotation_rad)
+        end.y = self.start.y - length * math.cos(rotation_rad)
+        self.length = length
+        self.angle = rotation
+
     #    @classmethod
     #    def from_joint(cls, joint: Joint, z_order: float, length: float, angle: float) -> Segment:
     #        return cls.from_point(joint.to_point(), z_order, length, angle, length)
@@ -73,6 +84,31 @@ SHIN_SIZE = 43
 FOOT_SIZE = 26
 
 
+# Order of the BodyParams angles when a pose is packed into a flat sequence
+# (e.g. one row of the N x 18 arrays used by stickman_np). Body.segments[i + 1]
+# is driven by PARAM_FIELDS[i]; the spine is segment 0 and has no parameter.
+PARAM_FIELDS = (
+    "spine_neck",
+    "neck_head",
+    "neck_left_collar_bone",
+    "left_collar_bone_left_upper_arm",
+    "left_upper_arm_left_forearm",
+    "left_forearm_left_hand",
+    "neck_right_collar_bone",
+    "right_collar_bone_right_upper_arm",
+    "right_upper_arm_right_forearm",
+    "right_forearm_right_hand",
+    "spine_left_hip",
+    "left_hip_left_thigh",
+    "left_thigh_left_shin",
+    "left_shin_left_foot",
+    "spine_right_hip",
+    "right_hip_right_thigh",
+    "right_thigh_right_shin",
+    "right_shin_right_foot",
+)
+
+
 class BodyParams:
     """
          Class that contains all the configurations params for all parts of the body.
@@ -90,6 +126,8 @@ class BodyParams:
      All angles expressed in degrees, clockwise (which may be confusing we
      may need to switch this convention to the polar coordinate system)
     """
+    __slots__ = PARAM_FIELDS
+
     def __init__(self):
         self.spine_neck: float = 0  # colinear
         self.neck_head: float = 90.0
@@ -113,17 +151,98 @@ class BodyParams:
         self.right_hip_right_thigh: float = -75.0
         self.right_thigh_right_shin: float = -15.0
         self.right_shin_right_foot: float = 90.0
-        
+
+    def copy_from(self, other):
+        """Overwrites every angle with the ones from other, without allocating"""
+        for field_name in PARAM_FIELDS:
+            setattr(self, field_name, getattr(other, field_name))
+
+
+SEGMENT_NAMES = (
+    "spine",
+    "neck",
+    "face",
+    "left_collar_bone",
+    "left_upper_arm",
+    "left_forearm",
+    "left_hand",
+    "right_collar_bone",
+    "right_upper_arm",
+    "right_forearm",
+    "right_hand",
+    "left_hip",
+    "left_thigh",
+    "left_shin",
+    "left_foot",
+    "right_hip",
+    "right_thigh",
+    "right_shin",
+    "right_foot",
+)
+
+# How each non-spine segment hangs off the skeleton, in Body.segments order
+# starting at the neck. Each entry is
+#   (anchor segment, True if anchored at its end / False at its start,
+#    segment whose angle this one is relative to, Body attribute with the length)
+SKELETON = (
+    (0, False, 0, "neck_size"),  # neck
+    (1, True, 1, "face_size"),  # face
+    (0, False, 1, "shoulder_size"),  # left collar bone
+    (3, True, 3, "upper_arm_size"),  # left upper arm
+    (4, True, 4, "forearm_size"),  # left forearm
+    (5, True, 5, "hand_size"),  # left hand
+    (0, False, 1, "shoulder_size"),  # right collar bone
+    (7, True, 7, "upper_arm_size"),  # right upper arm
+    (8, True, 8, "forearm_size"),  # right forearm
+    (9, True, 9, "hand_size"),  # right hand
+    (0, True, 0, "hip_size"),  # left hip
+    (11, True, 11, "thigh_size"),  # left thigh
+    (12, True, 12, "shin_size"),  # left shin
+    (13, True, 13, "foot_size"),  # left foot
+    (0, True, 0, "hip_size"),  # right hip
+    (15, True, 15, "thigh_size"),  # right thigh
+    (16, True, 16, "shin_size"),  # right shin
+    (17, True, 17, "foot_size"),  # right foot
+)
+
+
+def _downstream() -> tuple:
+    result = []
+    for index in range(len(SKELETON)):
+        segments = [index + 1]
+        for child in range(index + 2, len(SKELETON) + 1):
+            anchor, at_end, relative_to, size_name = SKELETON[child - 1]
+            if anchor in segments or relative_to in segments:
+                segments.append(child)
+        result.append(tuple(segments))
+    return tuple(result)
+
+
+# The segments that move when PARAM_FIELDS[i] changes: segment i + 1 and every
+# segment hanging off it or measuring its angle from it, in Body.segments order
+DOWNSTREAM = _downstream()
 
 
 class Body:
     def __init__(self, width, height, overall_scale_factor:float=3.0):
         self.width = width
         self.height = height
-        self.segments: list[Segments] = []
         self.center = (width / 2, height / 3)
         self.set_scale_factor(overall_scale_factor)
 
+        # The segments are built once and then moved in place by update_params,
+        # so steady-state rendering doesn't allocate new Points/Segments. Each
+        # segment's start Point is the same object as its anchor's end (or start)
+        # Point, so moving a parent moves where its children begin.
+        spine = Segment(Point(0, 0), Point(0, 0), 0, 0, 0)
+        self.segments: list[Segment] = [spine]
+        for anchor, at_end, relative_to, size_name in SKELETON:
+            parent = self.segments[anchor]
+            start = parent.end if at_end else parent.start
+            self.segments.append(Segment(start, Point(0, 0), 0, 0, 0))
+        self.sorted_segments = sorted(self.segments, key=lambda segment: segment.z_order)
+        self.update_params(BodyParams())
+
     def set_scale_factor(self, overall_scale_factor: float):
         self.overall_scale_factor = overall_scale_factor
         self.scale_factor = (self.height / overall_scale_factor) / SPINE_SIZE
@@ -138,153 +257,239 @@ class Body:
         self.thigh_size = THIGH_SIZE * self.scale_factor
         self.shin_size = SHIN_SIZE * self.scale_factor
         self.foot_size = FOOT_SIZE * self.scale_factor
+        # Lengths of segments 1..18 in Body.segments order
+        self.segment_sizes = [getattr(self, size_name) for _, _, _, size_name in SKELETON]
+        self.invalidate()
+
+    def invalidate(self):
+        """Forces the next update_params to recompute every segment"""
+        # The angles used for the last update, and which segments it moved
+        self.last_params = [0.0] * len(PARAM_FIELDS)
+        self.changed = [True] * (len(SKELETON) + 1)
+        self.stale = True
+
+    def mark_changed(self, params: BodyParams) -> bool:
+        """Compares params with the last update and sets changed[i] for every
+        segment that has to move (following DOWNSTREAM). Returns whether any did."""
+        changed = self.changed
+        last = self.last_params
+        stale = self.stale
+        self.stale = False
+        for index in range(len(changed)):
+            changed[index] = stale
+        moved = stale
+        for index in range(len(PARAM_FIELDS)):
+            value = getattr(params, PARAM_FIELDS[index])
+            if stale or value != last[index]:
+                last[index] = value
+                moved = True
+                for segment_index in DOWNSTREAM[index]:
+                    changed[segment_index] = True
+        return moved
 
     def update_params(self, params: BodyParams):
-        """Updates the segments"""
-        self.segments = []
-
+        """Updates the segments (in place). Only the chains hanging off fields
+        that changed since the last update are recomputed; changed says which
+        segments moved, so renderers can skip redrawing the rest."""
         # Order of calculation: Spine Neck Face Shoulders Upper Arm Fore Arm Hand Hips Thighs Shins Feet
+        if not self.mark_changed(params):
+            return
+        segments = self.segments
+        changed = self.changed
+        if changed[0]:
+            self.update_spine()
+
+        sizes = self.segment_sizes
+        for index in range(len(SKELETON)):
+            if not changed[index + 1]:
+                continue
+            segments[index + 1].update(
+                sizes[index],
+                segments[SKELETON[index][2]].angle
+                + getattr(params, PARAM_FIELDS[index]),
+            )
+
+    def update_spine(self):
+        spine = self.segments[0]
+        spine.start.x = self.center[0]
+        spine.start.y = int(self.center[1] - self.spine_size / 2)
+        spine.end.x = self.center[0]
+        spine.end.y = int(self.center[1] + self.spine_size / 2)
+        spine.length = self.spine_size
 
-        #        neck_bottom = Joint(CENTER[0], int(CENTER[1] - SPINE_SIZE/2))
-        #        hip = Joint(CENTER[0], int(CENTER[1] + SPINE_SIZE/2))
-        spine = Segment(
-            Point(self.center[0], int(self.center[1] - self.spine_size / 2)),
-            Point(self.center[0], int(self.center[1] + self.spine_size / 2)),
-            self.spine_size,
-            0,
-            0,
-        )
-        self.segments.append(spine)
-
-        neck = Segment.from_point(spine.start, self.neck_size, params.spine_neck, 0)
-        self.segments.append(neck)
-
-        face = Segment.from_point(
-            neck.end, self.face_size, neck.angle + params.neck_head, 0
-        )
-        self.segments.append(face)
-
-        left_collar_bone = Segment.from_point(
-            spine.start,
-            self.shoulder_size,
-            neck.angle + params.neck_left_collar_bone,
-            0,
-        )
-        self.segments.append(left_collar_bone)
-
-        left_upper_arm = Segment.from_point(
-            left_collar_bone.end,
-            self.upper_arm_size,
-            left_collar_bone.angle + params.left_collar_bone_left_upper_arm,
-            0,
-        )
-        self.segments.append(left_upper_arm)
-
-        left_forearm = Segment.from_point(
-            left_upper_arm.end,
-            self.forearm_size,
-            left_upper_arm.angle + params.left_upper_arm_left_forearm,
-            0,
-        )
-        self.segments.append(left_forearm)
-
-        left_hand = Segment.from_point(
-            left_forearm.end,
-            self.hand_size,
-            left_forearm.angle + params.left_forearm_left_hand,
-            0,
-        )
-        self.segments.append(left_hand)
-
-        right_collar_bone = Segment.from_point(
-            spine.start,
-            self.shoulder_size,
-            neck.angle + params.neck_right_collar_bone,
-            0,
-        )
-        self.segments.append(right_collar_bone)
-
-        right_upper_arm = Segment.from_point(
-            right_collar_bone.end,
-            self.upper_arm_size,
-            right_collar_bone.angle + params.right_collar_bone_right_upper_arm,
-            0,
-        )
-        self.segments.append(right_upper_arm)
-
-        right_forearm = Segment.from_point(
-            right_upper_arm.end,
-            self.forearm_size,
-            right_upper_arm.angle + params.right_upper_arm_right_forearm,
-            0,
-        )
-        self.segments.append(right_forearm)
-
-        right_hand = Segment.from_point(
-            right_forearm.end,
-            self.hand_size,
-            right_forearm.angle + params.right_forearm_right_hand,
-            0,
-        )
-        self.segments.append(right_hand)
-
-        left_hip = Segment.from_point(
-            spine.end, self.hip_size, spine.angle + params.spine_left_hip, 0
-        )
-        self.segments.append(left_hip)
-
-        left_thigh = Segment.from_point(
-            left_hip.end,
-            self.thigh_size,
-            left_hip.angle + params.left_hip_left_thigh,
-            0,
-        )
-        self.segments.append(left_thigh)
-
-        left_shin = Segment.from_point(
-            left_thigh.end,
-            self.shin_size,
-            left_thigh.angle + params.left_thigh_left_shin,
-            0,
-        )
-        self.segments.append(left_shin)
-
-        left_foot = Segment.from_point(
-            left_shin.end,
-            self.foot_size,
-            left_shin.angle + params.left_shin_left_foot,
-            0,
-        )
-        self.segments.append(left_foot)
-
-        right_hip = Segment.from_point(
-            spine.end, self.hip_size, spine.angle + params.spine_right_hip, 0
-        )
-        self.segments.append(right_hip)
-
-        right_thigh = Segment.from_point(
-            right_hip.end,
-            self.thigh_size,
-            right_hip.angle + params.right_hip_right_thigh,
-            0,
+    def get_segments(self) -> list[Segment]:
+        return self.sorted_segments
+
+
+# Fixed point formats used by FixedPointBody
+SINE_BITS = 14  # sine table entries are sin * 2**14
+POSITION_BITS = 8  # positions and lengths are pixels * 2**8
+
+
+class FixedPointBody(Body):
+    """Body that solves poses with a sine lookup table and integer (fixed
+    point) arithmetic instead of math.sin/cos on floats, for microcontrollers.
+
+    resolution is the angle step of the table in degrees (it has to divide 90
+    evenly); joint angles are rounded to it. Rounding an angle moves a limb's
+    end by its length times the error, so the error grows with the size of
+    the body: with resolution None (the default) the coarsest step of 1, 1/2,
+    1/4 ... degrees (down to MIN_RESOLUTION) that keeps this under
+    ANGLE_ERROR_PIXELS is picked for the current size and scale (1 degree for
+    a 64x32 display). Endpoints are then whole pixels within about a pixel of
+    Body (see max_endpoint_error) up to roughly 500x500; an explicit
+    resolution gives errors that grow with the size. Segment angles are kept
+    as table indexes in angle_steps rather than in Segment.angle."""
+
+    # Most an endpoint may move from rounding angles, with resolution None
+    ANGLE_ERROR_PIXELS = 0.75
+    # Finest resolution picked automatically (a 5760 entry table)
+    MIN_RESOLUTION = 1 / 16
+
+    def __init__(
+        self,
+        width,
+        height,
+        overall_scale_factor: float = 3.0,
+        resolution: float = None,
+    ):
+        self.auto_resolution = resolution is None
+        self.resolution = None
+        if not self.auto_resolution:
+            self.set_resolution(resolution)
+        segment_count = len(SKELETON) + 1
+        self.angle_steps = array("l", [0] * segment_count)
+        # Fixed point start and end of every segment
+        self.fixed_start_x = array("l", [0] * segment_count)
+        self.fixed_start_y = array("l", [0] * segment_count)
+        self.fixed_end_x = array("l", [0] * segment_count)
+        self.fixed_end_y = array("l", [0] * segment_count)
+        super().__init__(width, height, overall_scale_factor)
+
+    def set_resolution(self, resolution: float):
+        """Builds the sine table for a step of resolution degrees"""
+        table_size = round(360 / resolution)
+        if table_size % 4 or abs(table_size * resolution - 360) > 1e-9:
+            raise ValueError(f"Resolution {resolution} doesn't divide 90 degrees")
+        self.resolution = resolution
+        self.steps_per_degree = 1 / resolution
+        self.table_size = table_size
+        self.quarter_turn = table_size // 4
+        scale = 1 << SINE_BITS
+        self.sine_table = array(
+            "l",
+            [
+                round(math.sin(math.radians(step * resolution)) * scale)
+                for step in range(table_size)
+            ],
         )
-        self.segments.append(right_thigh)
 
-        right_shin = Segment.from_point(
-            right_thigh.end,
-            self.shin_size,
-            right_thigh.angle + params.right_thigh_right_shin,
-            0,
-        )
-        self.segments.append(right_shin)
+    def angle_error(self, resolution: float) -> float:
+        """Most any endpoint can move (in pixels) from rounding every joint
+        angle to resolution degrees: each limb's length times the error of
+        its angle, which adds up along the chain of joints above it"""
+        segment_count = len(SKELETON) + 1
+        depth = [0] * segment_count
+        start_error = [0.0] * segment_count
+        end_error = [0.0] * segment_count
+        half_step = math.radians(resolution) / 2
+        for index, (anchor, at_end, relative_to, _) in enumerate(SKELETON):
+            segment = index + 1
+            depth[segment] = depth[relative_to] + 1
+            if at_end:
+                start_error[segment] = end_error[anchor]
+            else:
+                start_error[segment] = start_error[anchor]
+            end_error[segment] = (
+                start_error[segment]
+                + self.segment_sizes[index] * depth[segment] * half_step
+            )
+        return max(end_error)
 
-        right_foot = Segment.from_point(
-            right_shin.end,
-            self.foot_size,
-            right_shin.angle + params.right_shin_right_foot,
-            0,
+    def set_scale_factor(self, overall_scale_factor: float):
+        super().set_scale_factor(overall_scale_factor)
+        self.fixed_sizes = array(
+            "l", [round(size * (1 << POSITION_BITS)) for size in self.segment_sizes]
         )
-        self.segments.append(right_foot)
+        if self.auto_resolution:
+            resolution = 1.0
+            while (
+                resolution > self.MIN_RESOLUTION
+                and self.angle_error(resolution) > self.ANGLE_ERROR_PIXELS
+            ):
+                resolution /= 2
+            if resolution != self.resolution:
+                self.set_resolution(resolution)
 
-    def get_segments(self) -> list[Segment]:
-        return sorted(self.segments, key=lambda segment: segment.z_order)
+    def update_params(self, params: BodyParams):
+        """Updates the segments (in place), only the ones that changed"""
+        if not self.mark_changed(params):
+            return
+        changed = self.changed
+        if changed[0]:
+            self.update_spine()
+        segments = self.segments
+        spine = segments[0]
+        start_x = self.fixed_start_x
+        start_y = self.fixed_start_y
+        end_x = self.fixed_end_x
+        end_y = self.fixed_end_y
+        start_x[0] = end_x[0] = round(spine.start.x * (1 << POSITION_BITS))
+        start_y[0] = spine.start.y << POSITION_BITS
+        end_y[0] = spine.end.y << POSITION_BITS
+
+        sine = self.sine_table
+        table_size = self.table_size
+        quarter_turn = self.quarter_turn
+        steps_per_degree = self.steps_per_degree
+        angle_steps = self.angle_steps
+        sizes = self.fixed_sizes
+        half_pixel = 1 << (POSITION_BITS - 1)
+        for index in range(len(SKELETON)):
+            segment_index = index + 1
+            if not changed[segment_index]:
+                continue
+            anchor, at_end, relative_to, size_name = SKELETON[index]
+            angle = (
+                angle_steps[relative_to]
+                + round(getattr(params, PARAM_FIELDS[index]) * steps_per_degree)
+            ) % table_size
+            angle_steps[segment_index] = angle
+
+            if at_end:
+                x = end_x[anchor]
+                y = end_y[anchor]
+            else:
+                x = start_x[anchor]
+                y = start_y[anchor]
+            start_x[segment_index] = x
+            start_y[segment_index] = y
+            length = sizes[index]
+            x += (length * sine[angle]) >> SINE_BITS
+            y -= (length * sine[(angle + quarter_turn) % table_size]) >> SINE_BITS
+            end_x[segment_index] = x
+            end_y[segment_index] = y
+
+            segment = segments[segment_index]
+            # Round to the nearest whole pixel
+            segment.end.x = (x + half_pixel) >> POSITION_BITS
+            segment.end.y = (y + half_pixel) >> POSITION_BITS
+            segment.length = self.segment_sizes[index]
+
+
+def max_endpoint_error(body: Body, reference: Body, poses: list) -> float:
+    """Largest distance (in pixels) between any endpoint body and reference
+    compute over poses, e.g. to check a FixedPointBody against a Body"""
+    worst = 0.0
+    for params in poses:
+        body.update_params(params)
+        reference.update_params(params)
+        for segment, expected in zip(body.segments, reference.segments):
+            for point, expected_point in (
+                (segment.start, expected.start),
+                (segment.end, expected.end),
+            ):
+                error = math.hypot(point.x - expected_point.x, point.y - expected_point.y)
+                if error > worst:
+                    worst = error
+    return worst
@@ -0,0 +1,165 @@
+import numpy as np
+from stickman import Body, BodyParams, PARAM_FIELDS, SEGMENT_NAMES, SKELETON
+from stickman_np import params_to_array, solve_poses, START, END
+
+# Batch (NumPy) inverse kinematics: finds the angles that put an end effector
+# (the far end of a hand, foot or the face) on a target point, for any number
+# of poses/targets at once. Desktop only, like stickman_np.
+#
+#   angles, errors = solve_ik(body, params_to_array([pose]), "left_hand",
+#                             [(300, 250)])
+#
+# Solved with damped least squares: every iteration does one batched forward
+# solve (solve_poses), builds each pose's 2 x fields Jacobian from the segment
+# vectors and takes a damped Gauss-Newton step. Only the chosen fields move;
+# unreachable targets end up as close as the chain reaches.
+
+# Effector name -> (segment whose end is the effector, fields solved by default)
+EFFECTORS = {
+    "head": ("face", ("spine_neck", "neck_head")),
+    "left_hand": (
+        "left_hand",
+        (
+            "left_collar_bone_left_upper_arm",
+            "left_upper_arm_left_forearm",
+            "left_forearm_left_hand",
+        ),
+    ),
+    "right_hand": (
+        "right_hand",
+        (
+            "right_collar_bone_right_upper_arm",
+            "right_upper_arm_right_forearm",
+            "right_forearm_right_hand",
+        ),
+    ),
+    "left_foot": (
+        "left_foot",
+        ("left_hip_left_thigh", "left_thigh_left_shin", "left_shin_left_foot"),
+    ),
+    "right_foot": (
+        "right_foot",
+        ("right_hip_right_thigh", "right_thigh_right_shin", "right_shin_right_foot"),
+    ),
+}
+
+
+def _rotation_fields(segment: int) -> set:
+    """PARAM_FIELDS indexes that a segment's rotation is the sum of"""
+    fields = set()
+    while segment != 0:
+        fields.add(segment - 1)
+        segment = SKELETON[segment - 1][2]
+    return fields
+
+
+def _position_segments(segment: int) -> list:
+    """Segments whose vectors, added to a (fixed) spine point, give the end
+    point of segment"""
+    segments = [segment]
+    # segment starts at the end (or start) of its anchor
+    anchor, at_end = SKELETON[segment - 1][:2]
+    while anchor != 0:
+        if at_end:
+            # An end is the segment's start plus its vector
+            segments.append(anchor)
+        anchor, at_end = SKELETON[anchor - 1][:2]
+    return segments
+
+
+def effector_matrix(segment: int, fields: [int]) -> np.ndarray:
+    """19 x len(fields) matrix of 0/1: whether turning fields[j] turns segment
+    k and moves the effector with it (the Jacobian's structure)"""
+    matrix = np.zeros((len(SKELETON) + 1, len(fields)))
+    for k in _position_segments(segment):
+        rotation_fields = _rotation_fields(k)
+        for column, field in enumerate(fields):
+            if field in rotation_fields:
+                matrix[k, column] = 1.0
+    return matrix
+
+
+def solve_ik(
+    body: Body,
+    angles,
+    effector: str,
+    targets,
+    fields: [str] = None,
+    iterations: int = 30,
+    tolerance: float = 0.25,
+    damping: float = 0.05,
+    max_step: float = 30.0,
+) -> (np.ndarray, np.ndarray):
+    """Moves effector (a key of EFFECTORS, or any segment name) onto targets.
+
+    angles are the starting poses (N x 18, or one pose for every target) and
+    targets N x 2 canvas points. fields are the PARAM_FIELDS allowed to change
+    (the effector's defaults if None). Stops once every effector is within
+    tolerance pixels or after iterations steps; max_step caps the change of
+    any angle per step in degrees and damping (times the spine length) keeps
+    steps small near singular poses. Returns the solved N x 18 angles and the
+    remaining distance to the target for each."""
+    segment_name, default_fields = EFFECTORS.get(effector, (effector, None))
+    segment = SEGMENT_NAMES.index(segment_name)
+    if fields is None:
+        if default_fields is None:
+            raise ValueError(f"No default fields for {effector}, pass fields")
+        fields = default_fields
+    columns = [PARAM_FIELDS.index(field) for field in fields]
+
+    targets = np.asarray(targets, dtype=float).reshape(-1, 2)
+    angles = np.array(angles, dtype=float).reshape(-1, len(PARAM_FIELDS))
+    if angles.shape[0] == 1 and targets.shape[0] > 1:
+        angles = np.repeat(angles, targets.shape[0], axis=0)
+    elif angles.shape[0] != targets.shape[0]:
+        raise ValueError(
+            f"{angles.shape[0]} poses don't match {targets.shape[0]} targets"
+        )
+
+    structure = effector_matrix(segment, columns)
+    segments = np.flatnonzero(structure.any(axis=1))
+    structure = structure[segments]
+    regularizer = (damping * body.spine_size) ** 2 * np.eye(2)
+
+    # Poses still short of their target; converged ones drop out
+    active = np.arange(angles.shape[0])
+    for _ in range(iterations):
+        endpoints = solve_poses(body, angles[active])
+        error = targets[active] - endpoints[:, segment, END]
+        unsolved = np.hypot(error[:, 0], error[:, 1]) > tolerance
+        if not unsolved.all():
+            active = active[unsolved]
+            endpoints = endpoints[unsolved]
+            error = error[unsolved]
+        if len(active) == 0:
+            break
+
+        # d(end point)/d(angle in radians) of a segment's vector (dx, dy) is
+        # (-dy, dx); each field sums that over the segments it turns
+        vectors = endpoints[:, segments, END] - endpoints[:, segments, START]
+        perpendicular = np.stack((-vectors[..., 1], vectors[..., 0]), axis=-1)
+        jacobian = np.einsum("nkc,kj->ncj", perpendicular, structure)
+
+        # Damped least squares: step = J^T (J J^T + lambda^2 I)^-1 error
+        square = jacobian @ jacobian.transpose(0, 2, 1) + regularizer
+        weights = np.linalg.solve(square, error[..., np.newaxis])
+        step = np.degrees((jacobian.transpose(0, 2, 1) @ weights)[..., 0])
+        angles[np.ix_(active, columns)] += np.clip(step, -max_step, max_step)
+
+    endpoints = solve_poses(body, angles)
+    error = targets - endpoints[:, segment, END]
+    return angles, np.hypot(error[:, 0], error[:, 1])
+
+
+def solve_ik_params(
+    body: Body, body_params: BodyParams, effector: str, target: (float, float), **options
+) -> (BodyParams, float):
+    """solve_ik for one pose, as BodyParams (a new one, body_params is left
+    alone). Returns the pose and the remaining distance."""
+    angles, errors = solve_ik(
+        body, params_to_array([body_params]), effector, [target], **options
+    )
+    result = BodyParams()
+    for field, value in zip(PARAM_FIELDS, angles[0]):
+        setattr(result, field, float(value))
+    return result, float(errors[0])
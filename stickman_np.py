@@ -0,0 +1,192 @@
+import numpy as np
+from stickman import Body, BodyParams, PARAM_FIELDS, SKELETON
+
+# Batch (NumPy) version of Body.update_params, for solving a whole timeline of
+# poses at once on the desktop. Not usable on CircuitPython.
+#
+# Results are indexed [frame, segment, start/end, x/y], with segments in the
+# same order as Body.segments (see stickman.SEGMENT_NAMES).
+
+START = 0
+END = 1
+
+
+def params_to_array(poses: [BodyParams]) -> np.ndarray:
+    """Pack a sequence of BodyParams into an N x 18 array in PARAM_FIELDS order"""
+    return np.array(
+        [[getattr(pose, field) for field in PARAM_FIELDS] for pose in poses],
+        dtype=float,
+    ).reshape(-1, len(PARAM_FIELDS))
+
+
+def solve_poses(body: Body, angles) -> np.ndarray:
+    """Computes the segment endpoints for N poses given as an N x 18 array of
+    angles. Returns an N x 19 x 2 x 2 array matching Body.update_params."""
+    angles = np.asarray(angles, dtype=float)
+    if angles.ndim == 1:
+        angles = angles[np.newaxis]
+    if angles.ndim != 2 or angles.shape[1] != len(PARAM_FIELDS):
+        raise ValueError(
+            f"Expected an N x {len(PARAM_FIELDS)} array of angles, got {angles.shape}"
+        )
+
+    frames = angles.shape[0]
+    segment_count = len(SKELETON) + 1
+    endpoints = np.empty((frames, segment_count, 2, 2))
+    rotations = np.zeros((frames, segment_count))
+
+    # Spine is fixed and vertical, same rounding as the scalar path
+    endpoints[:, 0, START] = (
+        body.center[0],
+        int(body.center[1] - body.spine_size / 2),
+    )
+    endpoints[:, 0, END] = (body.center[0], int(body.center[1] + body.spine_size / 2))
+
+    # Walk the skeleton once, solving each segment for every frame at a time.
+    # Parents always come before children in SKELETON.
+    for index, (anchor, at_end, relative_to, size_name) in enumerate(SKELETON, 1):
+        length = getattr(body, size_name)
+        rotations[:, index] = rotations[:, relative_to] + angles[:, index - 1]
+        rotation_rad = np.radians(rotations[:, index])
+        start = endpoints[:, anchor, END if at_end else START]
+        endpoints[:, index, START] = start
+        endpoints[:, index, END, 0] = start[:, 0] + length * np.sin(rotation_rad)
+        endpoints[:, index, END, 1] = start[:, 1] - length * np.cos(rotation_rad)
+
+    return endpoints
+
+
+def solve_params(body: Body, poses: [BodyParams]) -> np.ndarray:
+    """Convenience wrapper: solve_poses for a sequence of BodyParams"""
+    return solve_poses(body, params_to_array(poses))
+
+
+def segments_to_array(body: Body) -> np.ndarray:
+    """Current Body.segments as a 19 x 2 x 2 array (same layout as solve_poses)"""
+    return np.array(
+        [
+            ((segment.start.x, segment.start.y), (segment.end.x, segment.end.y))
+            for segment in body.segments
+        ],
+        dtype=float,
+    )
+
+
+class Framebuffer:
+    """A reusable uint8 pixel buffer (frames x height x width x channels) that
+    segments are drawn into with array operations rather than one ImageDraw
+    call per line. Without antialiasing lines come out very close to ImageDraw's
+    (rounding ties can land one pixel over).
+
+    The pixels are exposed without copying through buffer() (a memoryview) and
+    to_image(). Pillow can only share memory for 1 or 4 channel buffers ("L" /
+    "RGBX"), 3 channel "RGB" images get copied."""
+
+    def __init__(self, width: int, height: int, channels: int = 3, frames: int = 1):
+        self.width = width
+        self.height = height
+        self.channels = channels
+        self.pixels = np.zeros((frames, height, width, channels), dtype=np.uint8)
+        self._coverage = None
+
+    def clear(self):
+        self.pixels[:] = 0
+
+    def buffer(self, frame: int = 0) -> memoryview:
+        return memoryview(self.pixels[frame])
+
+    def to_image(self, frame: int = 0):
+        from PIL import Image
+
+        mode = {1: "L", 3: "RGB", 4: "RGBX"}[self.channels]
+        return Image.frombuffer(
+            mode, (self.width, self.height), self.pixels[frame], "raw", mode, 0, 1
+        )
+
+    def draw(
+        self,
+        endpoints,
+        color=255,
+        thickness: int = 1,
+        antialias: bool = False,
+        clear: bool = True,
+    ):
+        """Draws the segments of one frame (S x 2 x 2 endpoints, e.g. from
+        segments_to_array) or a batch of frames (N x S x 2 x 2, e.g. from
+        solve_poses) into frames 0..N-1. color is a single value, one value per
+        channel, or an S x channels array giving each segment its own color.
+        Segments are drawn in order, so later ones end up on top."""
+        endpoints = np.asarray(endpoints, dtype=float)
+        if endpoints.ndim == 3:
+            endpoints = endpoints[np.newaxis]
+        frames = endpoints.shape[0]
+        if frames > self.pixels.shape[0]:
+            raise ValueError(
+                f"{frames} frames don't fit in a {self.pixels.shape[0]} frame buffer"
+            )
+        pixels = self.pixels[:frames]
+        if clear:
+            pixels[:] = 0
+        segment_count = endpoints.shape[1]
+        colors = np.broadcast_to(
+            np.asarray(color, dtype=float), (segment_count, self.channels)
+        )
+        if not antialias:
+            # ImageDraw truncates coordinates to whole pixels before drawing
+            endpoints = np.trunc(endpoints)
+
+        # Sample every segment once per pixel along its major axis (a DDA),
+        # padded out to the longest segment and masked
+        start = endpoints[:, :, START]
+        delta = endpoints[:, :, END] - start
+        steps = np.ceil(np.abs(delta).max(axis=-1)).astype(int)
+        sample = np.arange(steps.max() + 1)
+        valid = sample <= steps[..., np.newaxis]
+        t = sample / np.maximum(steps, 1)[..., np.newaxis]
+        xs = start[..., 0, np.newaxis] + t * delta[..., 0, np.newaxis]
+        ys = start[..., 1, np.newaxis] + t * delta[..., 1, np.newaxis]
+        steep = (np.abs(delta[..., 1]) > np.abs(delta[..., 0]))[..., np.newaxis]
+        major = np.rint(np.where(steep, ys, xs))
+
+        # Thickness spreads each sample across the minor axis
+        offsets = np.arange(thickness) - (thickness - 1) / 2
+        minor = np.where(steep, xs, ys)[..., np.newaxis] + offsets
+        major = np.broadcast_to(major[..., np.newaxis], minor.shape)
+        steep = steep[..., np.newaxis]
+        valid = np.broadcast_to(valid[..., np.newaxis], minor.shape)
+        frame_index = np.broadcast_to(
+            np.arange(frames).reshape(-1, 1, 1, 1), minor.shape
+        )
+        segment_index = np.broadcast_to(
+            np.arange(segment_count).reshape(1, -1, 1, 1), minor.shape
+        )
+
+        if antialias:
+            # Wu style: split each sample between the two nearest pixels
+            floor = np.floor(minor)
+            fraction = minor - floor
+            passes = ((floor, 1 - fraction), (floor + 1, fraction))
+            if self._coverage is None:
+                self._coverage = np.zeros(self.pixels.shape, dtype=np.float32)
+            coverage = self._coverage[:frames]
+            coverage[:] = 0
+        else:
+            passes = ((np.rint(minor), None),)
+
+        for minor_pixels, weight in passes:
+            x = np.where(steep, minor_pixels, major).astype(int)
+            y = np.where(steep, major, minor_pixels).astype(int)
+            mask = valid & (x >= 0) & (x < self.width) & (y >= 0) & (y < self.height)
+            if weight is None:
+                pixels[frame_index[mask], y[mask], x[mask]] = colors[
+                    segment_index[mask]
+                ]
+            else:
+                np.maximum.at(
+                    coverage,
+                    (frame_index[mask], y[mask], x[mask]),
+                    weight[mask][:, np.newaxis] * colors[segment_index[mask]],
+                )
+
+        if antialias:
+            np.maximum(pixels, coverage.astype(np.uint8), out=pixels)
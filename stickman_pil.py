@@ -1,6 +1,7 @@
 import copy 
+from collections import OrderedDict
 from PIL import Image, ImageDraw
-from stickman import Body, BodyParams
+from stickman import Body, BodyParams, PARAM_FIELDS
 from tweener import produce_tweens
 
 BODY_COLOR = (255, 255, 255)
@@ -10,19 +11,154 @@ def scale_color(color: (int, int, int), scale: float) -> (int, int, int):
     return (int(color[0] * scale), int(color[1] * scale), int(color[2] * scale))
 
 
-def make_pil_frame(body: Body, body_params: BodyParams) -> Image:
-    frame_image = Image.new("RGB", (body.width, body.height))
+class BodyPalette:
+    """A fixed palette for drawing frames straight into "P" images, so GIF
+    encoding has nothing left to quantize. Index 0 is the black background
+    and there is one entry per z-order level of the body, colored exactly as
+    the RGB frames are (scale_color(color, 1 - z_order)).
+
+    Every frame gets the same palette, so it can be written once as the GIF's
+    global color table (see StreamingGifWriter's palette argument)."""
+
+    def __init__(self, body: Body, color: (int, int, int) = BODY_COLOR):
+        self.levels = sorted(set(segment.z_order for segment in body.segments))
+        if len(self.levels) > 255:
+            raise ValueError(f"{len(self.levels)} z-order levels don't fit a palette")
+        self.colors = [(0, 0, 0)] + [scale_color(color, 1 - z) for z in self.levels]
+        # z_order -> palette index
+        self.index = {z: index for index, z in enumerate(self.levels, 1)}
+        self.palette = bytes(channel for rgb in self.colors for channel in rgb)
+        self._image: Image = None
+
+    def new_image(self, size: (int, int)) -> Image:
+        image = Image.new("P", size, 0)
+        image.putpalette(self.palette)
+        return image
+
+    def image(self) -> Image:
+        """A tiny "P" image holding the palette (for StreamingGifWriter)"""
+        if self._image is None:
+            self._image = self.new_image((1, 1))
+        return self._image
+
+
+class FrameCache:
+    """LRU cache of rendered frames, keyed by the pose (quantized to
+    resolution degrees) and the canvas size/scale. Bounded by the total size
+    of the cached images in bytes."""
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, resolution: float = 0.01):
+        self.max_bytes = max_bytes
+        self.resolution = resolution
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, body: Body, body_params: BodyParams) -> tuple:
+        pose = tuple(
+            round(getattr(body_params, field) / self.resolution)
+            for field in PARAM_FIELDS
+        )
+        return (body.width, body.height, body.overall_scale_factor, pose)
+
+    def get(self, key):
+        """Returns the cached image or None"""
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return entry
+
+    @staticmethod
+    def image_size(image: Image) -> int:
+        return image.width * image.height * len(image.getbands())
+
+    def put(self, key, image: Image):
+        entry_size = self.image_size(image)
+        if entry_size > self.max_bytes:
+            return
+        old_image = self.entries.pop(key, None)
+        if old_image is not None:
+            self.size -= self.image_size(old_image)
+        self.entries[key] = image
+        self.size += entry_size
+        while self.size > self.max_bytes:
+            _, old_image = self.entries.popitem(last=False)
+            self.size -= self.image_size(old_image)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self.entries),
+            "bytes": self.size,
+        }
+
+
+def make_pil_frame(
+    body: Body,
+    body_params: BodyParams,
+    cache: FrameCache = None,
+    palette: BodyPalette = None,
+) -> Image:
+    """Draws one frame, as "RGB" or, with a palette, as "P" using that
+    palette. With a cache, a pose that was already drawn returns the same
+    Image object again (so don't draw on the result)."""
+    if cache is not None:
+        key = cache.key(body, body_params)
+        if palette is not None:
+            key += ("P",)
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
+    if palette is None:
+        frame_image = Image.new("RGB", (body.width, body.height))
+    else:
+        frame_image = palette.new_image((body.width, body.height))
     draw = ImageDraw.Draw(frame_image)
     body.update_params(body_params)
     segments = body.get_segments()
 
     for segment in segments:
-        draw.line(
-            segment.to_tuples(), fill=scale_color(BODY_COLOR, 1 - segment.z_order)
-        )
+        if palette is None:
+            fill = scale_color(BODY_COLOR, 1 - segment.z_order)
+        else:
+            fill = palette.index[segment.z_order]
+        draw.line(segment.to_tuples(), fill=fill)
+
+    if cache is not None:
+        cache.put(key, frame_image)
     return frame_image
 
 
+def pose_tuple(body_params: BodyParams) -> tuple:
+    """The angles of a pose in PARAM_FIELDS order (cheap to pickle)"""
+    return tuple(getattr(body_params, field_name) for field_name in PARAM_FIELDS)
+
+
+def make_pil_frames(
+    width: int, height: int, frames: list, palette: BodyPalette = None
+) -> [Image]:
+    """Draws a batch of frames, each given as an (overall scale factor,
+    pose_tuple) pair. This is module level so it can run in a worker process."""
+    body = Body(width, height)
+    body_params = BodyParams()
+    images = []
+    for scale, pose in frames:
+        if scale != body.overall_scale_factor:
+            body.set_scale_factor(scale)
+        for field_name, value in zip(PARAM_FIELDS, pose):
+            setattr(body_params, field_name, value)
+        images.append(make_pil_frame(body, body_params, palette=palette))
+    return images
+
+
 def append_pil_frame(frames: [Image], body: Body, body_params: BodyParams):
     frames.append(make_pil_frame(body, body_params))
 
@@ -0,0 +1,396 @@
+import os
+import struct
+from stickman import BodyParams, PARAM_FIELDS
+
+try:
+    import hashlib
+except ImportError:
+    hashlib = None
+import binascii
+
+# Compiled form of a .anim script.
+#
+# A script is a list of events, each an (op, arg) tuple:
+#   (REPEAT, count)       from "*count" - show the current frame count times
+#   (TWEEN, count)        from ">count" - tween to the next pose over count frames
+#   (OPTIONS, [(name, value), ...])    from "!name=value,..."
+#   (POSE, [(field index, value), ...]) from "field=value,..." where the index
+#                         is into stickman.PARAM_FIELDS
+#
+# parse_script() produces these straight from the text, compile_script() packs
+# them into a small binary file and Timeline unpacks them again. load() keeps the
+# compiled file next to the source (example.anim -> example.animc) so that
+# later runs skip the text parsing entirely.
+#
+# Binary layout (little endian):
+#   header:  b"ANIM", version (B), digest length (B), digest of the source text,
+#            length of the events that follow (I)
+#   REPEAT:  op (B), count (I)
+#   TWEEN:   op (B), count (I)
+#   POSE:    op (B), n (B), then n x [field index (B), value (d)]
+#   OPTIONS: op (B), n (B), then n x [name length (B), name,
+#            kind (B), then value (d) if kind is 0, or length (B) + text if 1]
+#
+# Values are doubles so a compiled script plays exactly like its text.
+
+MAGIC = b"ANIM"
+VERSION = 3
+COMPILED_SUFFIX = "c"
+
+REPEAT = 1
+TWEEN = 2
+POSE = 3
+OPTIONS = 4
+
+# Kinds of frame (see FrameIndex and Renderer.frames)
+NEW_FRAME = 0  # a new pose
+REPEAT_FRAME = 1  # the previous frame again (from "*N")
+TWEEN_FRAME = 2  # an in-between pose of a tween, fine to drop when behind
+
+_OPTION_FLOAT = 0
+_OPTION_STRING = 1
+
+
+def parse_params(line: str) -> list:
+    """Parses "name=value,..." into [(PARAM_FIELDS index, value), ...]"""
+    result = []
+    for param in line.split(","):
+        (name, value) = param.strip().split("=")
+        try:
+            index = PARAM_FIELDS.index(name)
+        except ValueError:
+            raise ValueError(f"Unknown body parameter {name}")
+        result.append((index, float(value)))
+    return result
+
+
+def parse_options(line: str) -> list:
+    """Parses "name=value,..." into [(name, value), ...]. Quoted values stay
+    strings (quotes included), everything else becomes a float."""
+    result = []
+    for param in line.split(","):
+        (name, value) = param.strip().split("=")
+        if value.startswith('"'):
+            result.append((name, value))
+        else:
+            result.append((name, float(value)))
+    return result
+
+
+def parse_script(lines):
+    """Yields the events for a text .anim script, one line at a time"""
+    for line in lines:
+        line = line.strip()
+        if line.startswith("#") or line == "":
+            continue
+        elif line.startswith("*"):
+            yield (REPEAT, int(line[1:]))
+        elif line.startswith(">"):
+            yield (TWEEN, int(line[1:]))
+        elif line.startswith("!"):
+            yield (OPTIONS, parse_options(line[1:]))
+        else:
+            yield (POSE, parse_params(line))
+
+
+def digest(source: bytes) -> bytes:
+    if hashlib is not None:
+        return hashlib.sha1(source).digest()
+    return struct.pack("<I", binascii.crc32(source) & 0xFFFFFFFF)
+
+
+def compile_script(lines, source_digest: bytes = b"") -> bytes:
+    """Packs a text .anim script into the binary timeline format. Raises
+    ValueError for anything that doesn't fit it (e.g. a negative count)."""
+    out = bytearray(MAGIC)
+    out += struct.pack("<BB", VERSION, len(source_digest))
+    out += source_digest
+    events = bytearray()
+    for op, arg in parse_script(lines):
+        try:
+            events += _pack_event(op, arg)
+        except struct.error as error:
+            raise ValueError(f"Can't compile {arg!r}: {error}")
+    out += struct.pack("<I", len(events))
+    return bytes(out + events)
+
+
+def _pack_event(op: int, arg) -> bytes:
+    if op == REPEAT or op == TWEEN:
+        return struct.pack("<BI", op, arg)
+    out = bytearray(struct.pack("<BB", op, len(arg)))
+    if op == POSE:
+        for index, value in arg:
+            out += struct.pack("<Bd", index, value)
+    else:
+        for name, value in arg:
+            name = name.encode()
+            out += struct.pack("<B", len(name)) + name
+            if isinstance(value, str):
+                value = value.encode()
+                out += struct.pack("<BB", _OPTION_STRING, len(value)) + value
+            else:
+                out += struct.pack("<Bd", _OPTION_FLOAT, value)
+    return bytes(out)
+
+
+class Timeline:
+    """A compiled .anim script. The events are decoded once, so a Timeline can
+    be handed to a Renderer and played any number of times."""
+
+    def __init__(self, data: bytes):
+        """Raises ValueError if data isn't a whole compiled animation"""
+        self.digest = compiled_digest(data)
+        try:
+            self.events = self._decode(data, 10 + len(self.digest))
+        except (struct.error, IndexError, UnicodeError):
+            raise ValueError("Truncated or damaged compiled animation")
+
+    @staticmethod
+    def _decode(data, offset: int) -> list:
+        events = []
+        while offset < len(data):
+            op = data[offset]
+            if op == REPEAT or op == TWEEN:
+                events.append((op, struct.unpack_from("<I", data, offset + 1)[0]))
+                offset += 5
+                continue
+
+            count = data[offset + 1]
+            offset += 2
+            values = []
+            if op == POSE:
+                for _ in range(count):
+                    values.append(struct.unpack_from("<Bd", data, offset))
+                    offset += 9
+            elif op == OPTIONS:
+                for _ in range(count):
+                    length = data[offset]
+                    name = bytes(data[offset + 1 : offset + 1 + length]).decode()
+                    offset += 1 + length
+                    kind = data[offset]
+                    if kind == _OPTION_STRING:
+                        length = data[offset + 1]
+                        value = bytes(data[offset + 2 : offset + 2 + length]).decode()
+                        offset += 2 + length
+                    else:
+                        value = struct.unpack_from("<d", data, offset + 1)[0]
+                        offset += 9
+                    values.append((name, value))
+            else:
+                raise ValueError(f"Bad opcode {op} in compiled animation")
+            events.append((op, values))
+        if offset > len(data):
+            raise ValueError("Truncated compiled animation")
+        return events
+
+
+def compiled_digest(data: bytes) -> bytes:
+    """The source digest in the header of a compiled animation, without
+    decoding the rest"""
+    if len(data) < 6 or data[:4] != MAGIC or data[4] != VERSION:
+        raise ValueError("Not a compiled animation (or wrong version)")
+    digest_length = data[5]
+    if len(data) < 10 + digest_length:
+        raise ValueError("Truncated compiled animation")
+    (length,) = struct.unpack_from("<I", data, 6 + digest_length)
+    if len(data) != 10 + digest_length + length:
+        raise ValueError("Truncated compiled animation")
+    return bytes(data[6 : 6 + digest_length])
+
+
+class FrameIndex:
+    """Random access to the frames of a script: the pose (and options) at any
+    frame number, found by binary search rather than by replaying the script
+    from the top. Built in one pass over the events (a Timeline's, or
+    parse_script's); each run of frames is stored once as a span:
+
+      hold   a pose shown count times ("*N", or a pose with no tween)
+      tween  start pose plus per-field deltas over count frames
+
+    The in-between poses are computed exactly like tweener.iter_tweens, so a
+    pose from the index is identical to the one Renderer.render() reaches."""
+
+    def __init__(self, events, start_pose: BodyParams = None):
+        if isinstance(events, Timeline):
+            events = events.events
+        # First frame number of each span, ascending (for the binary search)
+        self.starts = []
+        # (first kind, count, pose tuple, [(field, start, delta, end), ...],
+        # options) for each span. Options are the (name, value) pairs in
+        # effect, one tuple shared by every span until they change.
+        self.spans = []
+        self.frame_count = 0
+
+        if start_pose is None:
+            start_pose = BodyParams()
+        pose = [getattr(start_pose, field) for field in PARAM_FIELDS]
+        options = ()
+        tween_count = 0
+        for op, arg in events:
+            if op == REPEAT:
+                if arg > 0:
+                    first = NEW_FRAME if self.frame_count == 0 else REPEAT_FRAME
+                    self._add(first, arg, pose, None, options)
+            elif op == TWEEN:
+                tween_count = arg
+            elif op == OPTIONS:
+                config = dict(options)
+                config.update(arg)
+                options = tuple(config.items())
+            else:
+                end = list(pose)
+                for index, value in arg:
+                    end[index] = value
+                if tween_count > 0:
+                    changes = []
+                    for index in range(len(PARAM_FIELDS)):
+                        if pose[index] != end[index]:
+                            delta = (
+                                (end[index] - pose[index]) / (tween_count - 1)
+                                if tween_count > 1
+                                else 0.0
+                            )
+                            changes.append((index, pose[index], delta, end[index]))
+                    first = TWEEN_FRAME if tween_count > 1 else NEW_FRAME
+                    self._add(first, tween_count, pose, changes, options)
+                    tween_count = 0
+                else:
+                    self._add(NEW_FRAME, 1, end, None, options)
+                pose = end
+
+    def _add(self, first: int, count: int, pose: list, changes, options: tuple):
+        self.starts.append(self.frame_count)
+        self.spans.append((first, count, tuple(pose), changes, options))
+        self.frame_count += count
+
+    def __len__(self) -> int:
+        return self.frame_count
+
+    def find(self, frame: int) -> int:
+        """Index of the span holding frame"""
+        if frame < 0:
+            frame += self.frame_count
+        if not 0 <= frame < self.frame_count:
+            raise IndexError(f"Frame {frame} out of range ({self.frame_count})")
+        low = 0
+        high = len(self.starts)
+        while high - low > 1:
+            middle = (low + high) // 2
+            if self.starts[middle] <= frame:
+                low = middle
+            else:
+                high = middle
+        return low
+
+    def _frame(self, span: int, offset: int, into: BodyParams) -> int:
+        """Writes the pose offset frames into span into into, returns its kind"""
+        first, count, pose, changes, options = self.spans[span]
+        for field, value in zip(PARAM_FIELDS, pose):
+            setattr(into, field, value)
+        if changes is None:
+            return first if offset == 0 else REPEAT_FRAME
+        if offset == 0:
+            # Same as iter_tweens: the first step is the start pose itself
+            return first
+        last = offset == count - 1
+        for index, start, delta, end in changes:
+            setattr(
+                into, PARAM_FIELDS[index], end if last else start + offset * delta
+            )
+        return NEW_FRAME if last else TWEEN_FRAME
+
+    def pose(self, frame: int, into: BodyParams = None) -> BodyParams:
+        """The pose at frame, written into into (a new BodyParams if None)"""
+        if into is None:
+            into = BodyParams()
+        span = self.find(frame)
+        if frame < 0:
+            frame += self.frame_count
+        self._frame(span, frame - self.starts[span], into)
+        return into
+
+    def kind(self, frame: int) -> int:
+        span = self.find(frame)
+        if frame < 0:
+            frame += self.frame_count
+        first, count, pose, changes, options = self.spans[span]
+        offset = frame - self.starts[span]
+        if offset == 0:
+            return first
+        if changes is None:
+            return REPEAT_FRAME
+        return NEW_FRAME if offset == count - 1 else TWEEN_FRAME
+
+    def options(self, frame: int) -> tuple:
+        """The (name, value) options in effect at frame"""
+        return self.spans[self.find(frame)][4]
+
+    def frames(self, start: int = 0, stop: int = None, into: BodyParams = None):
+        """Yields (frame number, kind, pose, options) for frames start..stop-1,
+        with negative start/stop counting from the end like a slice. One
+        BodyParams (into) is reused for every frame, so copy it to keep it."""
+        if start < 0:
+            start = max(start + self.frame_count, 0)
+        if stop is None or stop > self.frame_count:
+            stop = self.frame_count
+        elif stop < 0:
+            stop += self.frame_count
+        if start >= stop:
+            return
+        if into is None:
+            into = BodyParams()
+        span = self.find(start)
+        frame = start
+        while frame < stop:
+            span_start = self.starts[span]
+            count = self.spans[span][1]
+            options = self.spans[span][4]
+            while frame < stop and frame - span_start < count:
+                kind = self._frame(span, frame - span_start, into)
+                yield frame, kind, into, options
+                frame += 1
+            span += 1
+
+
+def load(filename: str) -> Timeline:
+    """Loads a .anim script, using the compiled copy next to it if that was
+    built from the same source text, and (re)building it otherwise. If the
+    compiled copy can't be written (e.g. a read-only CIRCUITPY drive) the
+    script is just compiled in memory. A damaged compiled copy is rebuilt."""
+    with open(filename, "rb") as infile:
+        source = infile.read()
+    source_digest = digest(source)
+
+    compiled_name = filename + COMPILED_SUFFIX
+    try:
+        with open(compiled_name, "rb") as infile:
+            data = infile.read()
+        if compiled_digest(data) == source_digest:
+            return Timeline(data)
+    except (OSError, ValueError):
+        pass
+
+    data = compile_script(source.decode().splitlines(), source_digest)
+    # Written under a temporary name so an interrupted write never leaves a
+    # truncated copy behind
+    partial = compiled_name + ".part"
+    try:
+        with open(partial, "wb") as outfile:
+            outfile.write(data)
+        _replace(partial, compiled_name)
+    except OSError:
+        pass
+    return Timeline(data)
+
+
+def _replace(source: str, destination: str):
+    if hasattr(os, "replace"):
+        os.replace(source, destination)
+        return
+    # CircuitPython has no os.replace, and rename won't overwrite
+    try:
+        os.remove(destination)
+    except OSError:
+        pass
+    os.rename(source, destination)
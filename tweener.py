@@ -1,3 +1,5 @@
+from array import array
+
 try:
     import copy 
 except ImportError:
@@ -14,20 +16,30 @@ class TweenChange:
     end_value: float
 
 
-def produce_tweens(start, end, steps: int = 10):
+def field_names(obj):
+    # Slotted classes (like BodyParams) have no __dict__
+    return getattr(obj, "__slots__", None) or obj.__dict__.keys()
+
+
+def find_changes(start, end, steps: int) -> list:
+    """Returns (TweenChange, delta) for each field that differs between start and end"""
     # Assumptions:
     #   start.__class__ == end.__class__
     #   field types are floats
     #   linear interpolation between start and end values for each field that has a delta
-
-    # First, calculate all the fields that need tweenin
     changes: list[(TweenChange, delta)] = []
-    for field_name in start.__dict__.keys():
+    for field_name in field_names(start):
         start_value = getattr(start, field_name)
         end_value = getattr(end, field_name)
         if start_value != end_value:
-            delta = (end_value - start_value) / (steps - 1)
+            delta = (end_value - start_value) / (steps - 1) if steps > 1 else 0.0
             changes.append((TweenChange(field_name, start_value, end_value), delta))
+    return changes
+
+
+def produce_tweens(start, end, steps: int = 10):
+    # First, calculate all the fields that need tweenin
+    changes = find_changes(start, end, steps)
 
     results = []
     for step in range(steps):
@@ -42,12 +54,54 @@ def produce_tweens(start, end, steps: int = 10):
                 setattr(
                     new_tween,
                     change.field_name,
-                    getattr(start, change.field_name) + step * delta,
+                    change.start_value + step * delta,
                 )
             results.append(new_tween)
     return results
 
 
+def iter_tweens(start, end, steps: int = 10, buffer=None):
+    """Lazy version of produce_tweens. Yields the same poses, but every step is
+    written into one reused buffer (a copy of start unless one is passed in),
+    and only the fields that actually change are touched. Don't hold on to a
+    yielded pose past the next step - copy it if you need to keep it."""
+    changes = find_changes(start, end, steps)
+    if buffer is None:
+        buffer = copy.deepcopy(start)
+    else:
+        for field_name in field_names(start):
+            setattr(buffer, field_name, getattr(start, field_name))
+
+    for step in range(steps):
+        if step == steps - 1 and step != 0:
+            for change, delta in changes:
+                setattr(buffer, change.field_name, change.end_value)
+        elif step != 0:
+            for change, delta in changes:
+                setattr(buffer, change.field_name, change.start_value + step * delta)
+        yield buffer
+
+
+def tween_array(start, end, steps: int = 10) -> (list, array):
+    """Batched version of produce_tweens. Returns the names of the fields that
+    change and a flat float array holding their values for every step, row
+    major (steps x len(names)). Unchanged fields are left out entirely."""
+    changes = find_changes(start, end, steps)
+    names = [change.field_name for change, delta in changes]
+    values = array("d", [0.0]) * (steps * len(changes))
+    index = 0
+    for step in range(steps):
+        for change, delta in changes:
+            if step == 0:
+                values[index] = change.start_value
+            elif step == steps - 1:
+                values[index] = change.end_value
+            else:
+                values[index] = change.start_value + step * delta
+            index += 1
+    return names, values
+
+
 if __name__ == "__main__":
 
     class TestValue:
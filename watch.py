@@ -0,0 +1,372 @@
+import os
+import struct
+import sys
+import time
+import zlib
+from PIL import Image
+from stickman import Body, BodyParams
+from stickman_pil import make_pil_frame, BodyPalette, FrameCache
+from gif_writer import StreamingGifWriter, changed_box
+import timeline
+
+# Incremental rebuilds of a GIF while its .anim script is being edited:
+#
+#   python watch.py example.anim animation.gif
+#
+# The script is split into the spans of a timeline.FrameIndex (a tween, a
+# hold, a single pose). Each span is keyed by a hash of everything its frames
+# depend on: its own events, the pose it starts from, the options in effect
+# and the canvas. Editing one keyframe changes the key of the span it ends
+# (and, through their starting pose, of the spans after it up to the next
+# keyframe that sets the same fields) while every other span keeps its key.
+#
+# For each span the cache keeps the frames already GIF-encoded, so an
+# unchanged span is copied into the new GIF without being tweened, drawn or
+# encoded again. Like StreamingGifWriter, runs of identical frames become one
+# longer GIF frame, so the first and last runs of a span are kept as images and
+# encoded at build time: they may merge with the neighbouring spans, and the
+# first is stored as the change from whatever frame comes before it. The cache
+# lives in a directory (one file per span) so it survives restarts.
+
+SPAN_MAGIC = b"SPAN"
+SPAN_VERSION = 2
+
+
+def span_key(index: timeline.FrameIndex, span: int, canvas: tuple) -> str:
+    """Hex digest of everything the frames of a span depend on"""
+    first, count, pose, changes, options = index.spans[span]
+    description = repr((SPAN_VERSION, canvas, first, count, pose, changes, options))
+    return timeline.digest(description.encode()).hex()
+
+
+class SpanFrames:
+    """What the cache keeps for one span. Runs of identical frames are one GIF
+    frame shown for longer (as StreamingGifWriter does), and the first and
+    last runs are kept as images so they can still merge with the spans on
+    either side. Every run in between is already GIF-encoded."""
+
+    __slots__ = (
+        "first",
+        "first_duration",
+        "first_count",
+        "encoded",
+        "encoded_count",
+        "encoded_written",
+        "before_last",
+        "last",
+        "last_duration",
+        "last_count",
+    )
+
+    # first_count, first_duration, encoded_count, encoded_written, last_count,
+    # last_duration
+    COUNTS = "<IdIIId"
+
+    def __init__(self):
+        self.first: Image = None
+        self.first_duration = 0.0
+        self.first_count = 0
+        self.encoded = b""
+        self.encoded_count = 0
+        self.encoded_written = 0
+        # The frame the last run is drawn over (None with only one run)
+        self.before_last: Image = None
+        self.last: Image = None
+        self.last_duration = 0.0
+        self.last_count = 0
+
+    def write_to(self, writer: StreamingGifWriter):
+        writer.add_frame(self.first, self.first_duration, self.first_count)
+        if self.last is not None:
+            writer.add_encoded(
+                self.encoded, self.encoded_count, self.encoded_written, self.before_last
+            )
+            writer.add_frame(self.last, self.last_duration, self.last_count)
+
+    def to_bytes(self) -> bytes:
+        # magic, version, mode, width, height, COUNTS, then zlib compressed
+        # [first, before last, last frame pixels and palettes (empty for none),
+        # GIF blocks], each with a length
+        mode = self.first.mode.encode()
+        out = bytearray(SPAN_MAGIC)
+        out += struct.pack("<BB", SPAN_VERSION, len(mode)) + mode
+        out += struct.pack("<HH", self.first.width, self.first.height)
+        out += struct.pack(
+            self.COUNTS,
+            self.first_count,
+            self.first_duration,
+            self.encoded_count,
+            self.encoded_written,
+            self.last_count,
+            self.last_duration,
+        )
+        payload = bytearray()
+        for image in (self.first, self.before_last, self.last):
+            pixels = image.tobytes() if image is not None else b""
+            palette = b""
+            if image is not None and image.mode == "P":
+                palette = bytes(image.getpalette() or [])
+            for part in (pixels, palette):
+                payload += struct.pack("<I", len(part)) + part
+        payload += struct.pack("<I", len(self.encoded)) + self.encoded
+        return bytes(out) + zlib.compress(payload)
+
+    @classmethod
+    def from_bytes(cls, data: bytes):
+        if data[:4] != SPAN_MAGIC or data[4] != SPAN_VERSION:
+            raise ValueError("Not a cached span (or wrong version)")
+        offset = 6 + data[5]
+        mode = data[6:offset].decode()
+        width, height = struct.unpack_from("<HH", data, offset)
+        offset += 4
+        frames = cls()
+        (
+            frames.first_count,
+            frames.first_duration,
+            frames.encoded_count,
+            frames.encoded_written,
+            frames.last_count,
+            frames.last_duration,
+        ) = struct.unpack_from(cls.COUNTS, data, offset)
+        payload = zlib.decompress(data[offset + struct.calcsize(cls.COUNTS) :])
+        parts = []
+        offset = 0
+        for _ in range(7):
+            (length,) = struct.unpack_from("<I", payload, offset)
+            parts.append(payload[offset + 4 : offset + 4 + length])
+            offset += 4 + length
+        images = []
+        for pixels, palette in (parts[0:2], parts[2:4], parts[4:6]):
+            image = None
+            if pixels:
+                image = Image.frombytes(mode, (width, height), pixels)
+                if palette:
+                    image.putpalette(palette)
+            images.append(image)
+        frames.first, frames.before_last, frames.last = images
+        frames.encoded = parts[6]
+        return frames
+
+
+class SpanCache:
+    """SpanFrames by span key, in memory and as files in directory"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.entries = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def _filename(self, key: str) -> str:
+        return os.path.join(self.directory, key + ".span")
+
+    def get(self, key: str) -> SpanFrames:
+        entry = self.entries.get(key)
+        if entry is not None:
+            return entry
+        try:
+            with open(self._filename(key), "rb") as infile:
+                entry = SpanFrames.from_bytes(infile.read())
+        except (OSError, ValueError, struct.error, zlib.error):
+            return None
+        self.entries[key] = entry
+        return entry
+
+    def put(self, key: str, entry: SpanFrames):
+        self.entries[key] = entry
+        partial = self._filename(key) + ".part"
+        with open(partial, "wb") as outfile:
+            outfile.write(entry.to_bytes())
+        os.replace(partial, self._filename(key))
+
+    def prune(self, keep: set):
+        """Forgets every span not in keep (the ones the latest build used)"""
+        for key in list(self.entries):
+            if key not in keep:
+                del self.entries[key]
+        for filename in os.listdir(self.directory):
+            key, extension = os.path.splitext(filename)
+            if extension == ".span" and key not in keep:
+                os.remove(os.path.join(self.directory, filename))
+
+
+def render_span(
+    index: timeline.FrameIndex,
+    span: int,
+    body: Body,
+    writer: StreamingGifWriter,
+    palette: BodyPalette = None,
+    frame_cache: FrameCache = None,
+) -> SpanFrames:
+    """Draws the frames of one span and encodes all but its first and last
+    runs of identical frames"""
+    start = index.starts[span]
+    count = index.spans[span][1]
+    options = None
+    # [image, total duration, frames, box changed since the run before] for
+    # each run of identical frames
+    runs = []
+    for frame, kind, pose, frame_options in index.frames(start, start + count):
+        if frame_options is not options:
+            options = frame_options
+            config = dict(options)
+            body.set_scale_factor(config.get("scale", 3.0))
+        image = make_pil_frame(body, pose, frame_cache, palette)
+        duration = frame_duration(config)
+        box = changed_box(image, runs[-1][0]) if runs else None
+        if runs and box is None:
+            runs[-1][1] += duration
+            runs[-1][2] += 1
+        else:
+            runs.append([image, duration, 1, box])
+
+    frames = SpanFrames()
+    frames.first, frames.first_duration, frames.first_count, _ = runs[0]
+    if len(runs) > 1:
+        encoded = bytearray()
+        for previous, run in zip(runs, runs[1:-1]):
+            encoded += writer.encode_frame(run[0], previous[0], run[1], run[3])
+            frames.encoded_count += run[2]
+        frames.encoded = bytes(encoded)
+        frames.encoded_written = len(runs) - 2
+        frames.before_last = runs[-2][0]
+        frames.last, frames.last_duration, frames.last_count, _ = runs[-1]
+    return frames
+
+
+def frame_duration(config: dict) -> float:
+    # Same as PILRenderer.frame_duration
+    return 1000 / config.get("fps", 10)
+
+
+def build(
+    script: str,
+    output: str,
+    cache: SpanCache,
+    width: int = 500,
+    height: int = 500,
+    palette: bool = False,
+    frame_cache: FrameCache = None,
+) -> dict:
+    """(Re)builds output from script, reusing every cached span. Returns
+    counts of spans rebuilt and reused. Raises ValueError (leaving output as
+    it was) if the script has no frames."""
+    animation = timeline.load(script)
+    index = timeline.FrameIndex(animation, BodyParams())
+    if not index.spans:
+        raise ValueError("no frames to render")
+    body = Body(width, height)
+    body_palette = BodyPalette(body) if palette else None
+    canvas = (width, height, body_palette.colors if palette else None)
+
+    rebuilt = 0
+    reused = 0
+    keys = set()
+    partial = output + ".part"
+    with open(partial, "wb") as outfile:
+        writer = StreamingGifWriter(
+            outfile, palette=body_palette.image() if palette else None
+        )
+        writer.loop = int(dict(index.spans[0][4]).get("loop", 0))
+        for span in range(len(index.spans)):
+            key = span_key(index, span, canvas)
+            keys.add(key)
+            entry = cache.get(key)
+            if entry is None:
+                entry = render_span(
+                    index, span, body, writer, body_palette, frame_cache
+                )
+                cache.put(key, entry)
+                rebuilt += 1
+            else:
+                reused += 1
+            entry.write_to(writer)
+        writer.close()
+    os.replace(partial, output)
+    cache.prune(keys)
+    return {
+        "spans": len(index.spans),
+        "rebuilt": rebuilt,
+        "reused": reused,
+        "frames": len(index),
+    }
+
+
+def watch(
+    script: str,
+    output: str,
+    cache: SpanCache,
+    width: int = 500,
+    height: int = 500,
+    palette: bool = False,
+    interval: float = 0.5,
+):
+    """Rebuilds output every time script changes, until interrupted"""
+    frame_cache = FrameCache()
+    modified = None
+    while True:
+        try:
+            current = os.path.getmtime(script)
+        except OSError:
+            current = None
+        if current is not None and current != modified:
+            modified = current
+            started = time.perf_counter()
+            try:
+                result = build(
+                    script, output, cache, width, height, palette, frame_cache
+                )
+            except (ValueError, OSError) as error:
+                # Most likely a half-finished edit, wait for the next save
+                print(f"{script}: {error}", file=sys.stderr)
+            else:
+                print(
+                    f"Rebuilt {result['rebuilt']} of {result['spans']} segments"
+                    f" ({result['frames']} frames) in"
+                    f" {time.perf_counter() - started:.2f}s -> {output}"
+                )
+        time.sleep(interval)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Rebuild a GIF whenever its .anim script changes, redrawing"
+        " only the segments that changed"
+    )
+    parser.add_argument("infile", help=".anim script")
+    parser.add_argument("outfile", nargs="?", default="animation.gif")
+    parser.add_argument(
+        "--cache",
+        help="directory for the segment cache (default: .animcache/<script name>)",
+    )
+    parser.add_argument("--size", type=int, default=500, help="canvas width/height")
+    parser.add_argument(
+        "--palette",
+        action="store_true",
+        help="draw palette frames with one global color table (no quantizing)",
+    )
+    parser.add_argument(
+        "--once", action="store_true", help="build once and exit instead of watching"
+    )
+    args = parser.parse_args()
+
+    cache_directory = args.cache or os.path.join(
+        os.path.dirname(args.infile), ".animcache", os.path.basename(args.infile)
+    )
+    cache = SpanCache(cache_directory)
+    if args.once:
+        try:
+            result = build(
+                args.infile, args.outfile, cache, args.size, args.size, args.palette
+            )
+        except ValueError as error:
+            sys.exit(f"{args.infile}: {error}")
+        print(f"Rebuilt {result['rebuilt']} of {result['spans']} segments")
+    else:
+        try:
+            watch(
+                args.infile, args.outfile, cache, args.size, args.size, args.palette
+            )
+        except KeyboardInterrupt:
+            pass